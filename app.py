@@ -1,21 +1,46 @@
-from flask import Flask, render_template, request, redirect, url_for, jsonify
-from transformers import pipeline
+from flask import Flask, render_template, request, redirect, url_for, jsonify, Response, stream_with_context, g
 from werkzeug.utils import secure_filename
+import csv
+import functools
 import os
 import json
+import io
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import cv2
 import numpy as np
-from attendance import recognize_faces, recognize_multiple_faces
+from attendance import embed_faces, embed_crops, get_inference_worker, load_image
+from face_detector import get_detector
+from stream_attendance import StreamSession, StreamSessionRegistry, decode_frame
+from gallery import get_gallery
+from attendance_store import get_store
+from user_directory import get_user_directory
+from jobs import get_job_queue, QueueFullError
+from recognition_cache import get_recognition_cache, content_hash, perceptual_hash
+from response_cache import get_response_cache, make_etag
+from media_store import get_media_store
+import model_registry
+import metrics
 
 app = Flask(__name__, static_folder='static')
 
-# Create uploads directory if it doesn't exist
+# Create uploads directory if it doesn't exist (only used for videos while they are processed)
 uploads_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
 if not os.path.exists(uploads_dir):
     os.makedirs(uploads_dir)
 
+# Set FAS_SAVE_UPLOADS=0 to stop keeping face crops and thumbnails of uploads
+SAVE_UPLOADS = os.environ.get('FAS_SAVE_UPLOADS', '1') == '1'
+
+# Attendance media is written on this background thread, off the request's latency path
+media_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='media-writer')
+
+# The photos of a multi-photo attendance session are recognized in parallel on this pool
+SESSION_WORKERS = int(os.environ.get('FAS_SESSION_WORKERS', 4))
+SESSION_MAX_IMAGES = int(os.environ.get('FAS_SESSION_MAX_IMAGES', 20))
+session_pool = ThreadPoolExecutor(max_workers=SESSION_WORKERS, thread_name_prefix='session-image')
+
 # Create data directory for storing user data
 data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
 if not os.path.exists(data_dir):
@@ -23,20 +48,97 @@ if not os.path.exists(data_dir):
 
 # Path to the user database JSON file
 users_db_path = os.path.join(data_dir, 'users.json')
-attendance_db_path = os.path.join(data_dir, 'attendance.json')
 
 # Initialize user database if it doesn't exist
 if not os.path.exists(users_db_path):
     with open(users_db_path, 'w') as f:
         json.dump([], f)
 
-# Initialize attendance database if it doesn't exist
-if not os.path.exists(attendance_db_path):
-    with open(attendance_db_path, 'w') as f:
-        json.dump([], f)
+# Attendance is stored in SQLite (data/attendance.db); any existing
+# data/attendance.json is imported the first time the store is opened
+attendance_store = get_store()
+
+# Open camera/video stream sessions, by id
+stream_sessions = StreamSessionRegistry()
+
+# Cached view of users.json, re-read only when the file changes
+user_directory = get_user_directory()
+
+# Recognition results for recently seen uploads, keyed by content hash
+recognition_cache = get_recognition_cache()
+
+# Rendered dashboard API responses, valid until the next attendance or user write
+response_cache = get_response_cache()
+
+# Face crops and thumbnails of uploads (data/media), compacted in the background
+media_store = None
+if SAVE_UPLOADS:
+    media_store = get_media_store()
+    media_store.start_compaction()
 
-# Load the image classification model
-face_recognition = pipeline('image-classification', model='microsoft/resnet-50')
+# The recognition model starts loading in the background as soon as the app starts,
+# so the readiness probe turns green without waiting for a recognition request.
+# Set FAS_WARMUP=0 to load it lazily on first use instead.
+if os.environ.get('FAS_WARMUP', '1') == '1':
+    model_registry.warm_up(background=True)
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    g.profiler = metrics.start_profiler()
+    metrics.start_trace()
+
+@app.after_request
+def finish_request_metrics(response):
+    started = getattr(g, 'request_started', None)
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    if metrics.METRICS_ENABLED:
+        metrics.request_latency.observe(elapsed, endpoint)
+    
+    # Per-stage timings of this request, readable in the browser's network panel
+    timings = metrics.end_trace()
+    if timings:
+        response.headers['Server-Timing'] = ', '.join(
+            f"{name};dur={seconds * 1000:.2f}" for name, seconds in timings.items())
+    
+    profiler = getattr(g, 'profiler', None)
+    if profiler is not None:
+        profiler.stop()
+        if elapsed * 1000 >= metrics.PROFILE_SLOW_MS:
+            app.logger.warning("Slow request %s took %.0f ms, profile saved to %s",
+                               endpoint, elapsed * 1000, profiler.save(endpoint))
+    return response
+
+@app.route('/metrics')
+def prometheus_metrics():
+    # Prometheus text format: latency histograms plus current queue and cache gauges
+    worker = get_inference_worker().stats()
+    recognition = recognition_cache.stats()
+    users = user_directory.stats()
+    responses = response_cache.stats()
+    lines = [
+        '# TYPE fas_inference_queue_depth gauge',
+        f"fas_inference_queue_depth {worker['queue_depth']}",
+        '# TYPE fas_model_ready gauge',
+        f"fas_model_ready {int(model_registry.is_ready())}",
+        '# TYPE fas_cache_hits_total counter',
+        f'fas_cache_hits_total{{cache="recognition"}} {recognition["hits"]}',
+        f'fas_cache_hits_total{{cache="users"}} {users["hits"]}',
+        f'fas_cache_hits_total{{cache="responses"}} {responses["hits"]}',
+        '# TYPE fas_cache_misses_total counter',
+        f'fas_cache_misses_total{{cache="recognition"}} {recognition["misses"]}',
+        f'fas_cache_misses_total{{cache="users"}} {users["misses"]}',
+        f'fas_cache_misses_total{{cache="responses"}} {responses["misses"]}',
+        '# TYPE fas_http_not_modified_total counter',
+        f"fas_http_not_modified_total {responses['not_modified']}"
+    ]
+    lines.append('# TYPE fas_attendance_jobs gauge')
+    for status, count in get_job_queue().stats().items():
+        lines.append(f'fas_attendance_jobs{{status="{status}"}} {count}')
+    return Response(metrics.render(lines), mimetype='text/plain; version=0.0.4')
 
 @app.route('/')
 def home():
@@ -60,6 +162,158 @@ def signup():
 def dashboard():
     return render_template('dashboard.html')
 
+def save_media(kind, image_data, faces):
+    # Keep a face crop per (username, position) and a thumbnail of the upload; returns the crop paths
+    if media_store is None or not faces:
+        return []
+    image, scale = load_image(image_data)
+    if image is None:
+        return []
+    boxes = [(username, tuple(int(round(position[key] / scale)) for key in ('x', 'y', 'width', 'height')))
+             for username, position in faces]
+    return media_store.save_event(kind, image, boxes)
+
+def persist_media(kind, image_data, faces):
+    # Queue save_media on the background writer
+    if media_store is None or not faces:
+        return None
+    return media_writer.submit(save_media, kind, image_data, faces)
+
+def recognize_upload(image_data, upload_hash=None):
+    # Match every face in an uploaded image (raw bytes) against the gallery; returns (matches, positions)
+    # Repeated uploads of the same image reuse the earlier matches without running the model
+    gallery = get_gallery()
+    matches = None
+    phash = None
+    if upload_hash is not None:
+        if recognition_cache.use_phash:
+            image = cv2.imdecode(np.frombuffer(image_data, dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_4)
+            phash = perceptual_hash(image) if image is not None else None
+        cached = recognition_cache.get(upload_hash, gallery.version, phash)
+        if cached is not None:
+            matches, positions = cached
+    
+    if matches is None:
+        # Embed every detected face and match them all against the gallery in one batch
+        # A close-up the detector misses can still be matched as a whole image
+        embeddings, positions = embed_faces(image_data, whole_image_fallback=True)
+        with metrics.stage('match'):
+            matches = gallery.match(embeddings)
+        if upload_hash is not None:
+            recognition_cache.put(upload_hash, gallery.version, (matches, positions), phash)
+    return matches, positions
+
+def process_attendance(image_data, attendance_mode, upload_hash=None):
+    # Recognize the faces in an uploaded image (raw bytes) and record attendance for matched users
+    recognized_users = []
+    results_text = ""
+    matches, positions = recognize_upload(image_data, upload_hash)
+    
+    # Recorded users and the position of the face each was recognized from
+    recorded_faces = []
+    
+    # Choose recognition method based on mode
+    if attendance_mode == 'individual':
+        # Take the single best match across the detected faces
+        best = None
+        for index, face_matches in enumerate(matches):
+            if face_matches and (best is None or face_matches[0]['score'] > best['score']):
+                best = face_matches[0]
+                best_position = positions[index]
+        
+        if best:
+            # Record attendance
+            record_attendance(best['username'])
+            recorded_faces.append((best['username'], best_position))
+            
+            results_text = f"User recognized: {best['username']}\nAttendance marked successfully!"
+            recognized_users.append({
+                'username': best['username'],
+                'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            })
+        else:
+            results_text = "Face not recognized. Please register first."
+    
+    else:  # Group mode
+        if not matches:
+            results_text = "No faces detected in the image."
+        else:
+            # Keep each user's best-scoring face so nobody is marked twice for one photo
+            best_by_user = {}
+            position_by_user = {}
+            for face_matches, position in zip(matches, positions):
+                if face_matches:
+                    match = face_matches[0]
+                    current = best_by_user.get(match['username'])
+                    if current is None or match['score'] > current['score']:
+                        best_by_user[match['username']] = match
+                        position_by_user[match['username']] = position
+            
+            # Record the whole group in a single transaction
+            for record in record_attendance_batch(list(best_by_user)):
+                recognized_users.append({
+                    'username': record['username'],
+                    'timestamp': record['timestamp']
+                })
+                recorded_faces.append((record['username'], position_by_user[record['username']]))
+            
+            recognized_count = len(best_by_user)
+            if recognized_count > 0:
+                results_text = f"Group attendance marked successfully! Recognized {recognized_count} users."
+            else:
+                results_text = "No registered users recognized in the group. Please ensure users are registered first."
+    
+    persist_media('attendance', image_data, recorded_faces)
+    return results_text, recognized_users
+
+def process_attendance_session(images):
+    """
+    Record attendance from several overlapping photos of one room
+    The photos are recognized in parallel, so the session takes about as long
+    as its slowest photo. Each user is matched by their best-scoring face over
+    all photos and recorded once, in a single transaction.
+    Returns (results_text, recognized_users, per-photo summaries)
+    """
+    futures = [session_pool.submit(recognize_upload, image_data, content_hash(image_data)) for image_data in images]
+    
+    best_by_user = {}
+    photos = []
+    for index, future in enumerate(futures):
+        try:
+            matches, positions = future.result()
+        except Exception as e:
+            photos.append({'faces': 0, 'error': str(e)})
+            continue
+        photos.append({'faces': len(positions), 'error': None})
+        for face_matches, position in zip(matches, positions):
+            if face_matches:
+                match = face_matches[0]
+                current = best_by_user.get(match['username'])
+                if current is None or match['score'] > current['score']:
+                    best_by_user[match['username']] = {'score': match['score'], 'photo': index, 'position': position}
+    
+    recognized_users = []
+    faces_by_photo = {}
+    for record in record_attendance_batch(list(best_by_user)):
+        best = best_by_user[record['username']]
+        recognized_users.append({
+            'username': record['username'],
+            'timestamp': record['timestamp'],
+            'score': best['score'],
+            'photo': best['photo']
+        })
+        faces_by_photo.setdefault(best['photo'], []).append((record['username'], best['position']))
+    # Keep each user's crop from the photo they were matched in
+    for index, faces in faces_by_photo.items():
+        persist_media('attendance', images[index], faces)
+    
+    if recognized_users:
+        results_text = (f"Session attendance marked successfully! Recognized {len(recognized_users)} users "
+                        f"in {len(images)} photos.")
+    else:
+        results_text = "No registered users recognized in the session photos. Please ensure users are registered first."
+    return results_text, recognized_users, photos
+
 @app.route('/attendance', methods=['GET', 'POST'])
 def attendance():
     if request.method == 'POST':
@@ -67,92 +321,26 @@ def attendance():
         if 'image' not in request.files:
             return render_template('attendance.html', error='No file part')
         
-        file = request.files['image']
-        if file.filename == '':
+        files = [file for file in request.files.getlist('image') if file.filename != '']
+        if not files:
             return render_template('attendance.html', error='No selected file')
+        if len(files) > SESSION_MAX_IMAGES:
+            return render_template('attendance.html', error=f"Upload at most {SESSION_MAX_IMAGES} photos at once")
         
-        filename = secure_filename(file.filename)
-        file_path = os.path.join(uploads_dir, filename)
-        file.save(file_path)
+        # Recognition works on the uploaded bytes; saving a copy happens off the request path
+        with metrics.stage('upload_read'):
+            images = [file.read() for file in files]
         
         # Get the attendance mode (individual or group)
         attendance_mode = request.form.get('mode', 'individual')
         
         try:
-            # Load user database
-            with open(users_db_path, 'r') as f:
-                users = json.load(f)
-            
-            recognized_users = []
-            results_text = ""
-            
-            # Choose recognition method based on mode
-            if attendance_mode == 'individual':
-                # Perform individual face recognition
-                recognition_results = recognize_faces(file_path)
-                
-                # Check if any face is recognized
-                user_found = False
-                
-                # Simple matching logic (in a real system, this would be more sophisticated)
-                for result in recognition_results:
-                    label = result['label']
-                    score = result['score']
-                    
-                    # Check if the label matches any registered user
-                    for user in users:
-                        if user.get('face_id') and label.lower() in user['face_id'].lower():
-                            user_found = True
-                            
-                            # Record attendance
-                            record_attendance(user['username'])
-                            
-                            results_text = f"User recognized: {user['username']}\nAttendance marked successfully!"
-                            recognized_users.append({
-                                'username': user['username'],
-                                'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                            })
-                            break
-                    
-                    if user_found:
-                        break
-                
-                if not user_found:
-                    results_text = "Face not recognized. Please register first."
-            
-            else:  # Group mode
-                # Perform group face recognition
-                recognition_results = recognize_multiple_faces(file_path)
-                
-                if not recognition_results:
-                    results_text = "No faces detected in the image."
-                else:
-                    # Track how many users were recognized
-                    recognized_count = 0
-                    
-                    # Process each recognition result
-                    for result in recognition_results:
-                        label = result['label']
-                        score = result['score']
-                        
-                        # Check if the label matches any registered user
-                        for user in users:
-                            if user.get('face_id') and label.lower() in user['face_id'].lower():
-                                # Record attendance
-                                record_attendance(user['username'])
-                                
-                                recognized_users.append({
-                                    'username': user['username'],
-                                    'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                                })
-                                
-                                recognized_count += 1
-                                break
-                    
-                    if recognized_count > 0:
-                        results_text = f"Group attendance marked successfully! Recognized {recognized_count} users."
-                    else:
-                        results_text = "No registered users recognized in the group. Please ensure users are registered first."
+            if len(images) > 1:
+                # Several photos of one room: each user is recorded once for the whole set
+                attendance_mode = 'group'
+                results_text, recognized_users, _ = process_attendance_session(images)
+            else:
+                results_text, recognized_users = process_attendance(images[0], attendance_mode, content_hash(images[0]))
             
             return render_template('attendance.html', 
                                   results=results_text, 
@@ -163,6 +351,178 @@ def attendance():
     
     return render_template('attendance.html')
 
+def run_attendance_job(image_data, attendance_mode, upload_hash=None):
+    # Worker-side body of an asynchronous attendance job
+    results_text, recognized_users = process_attendance(image_data, attendance_mode, upload_hash)
+    return {
+        'results': results_text,
+        'recognizedUsers': recognized_users,
+        'mode': attendance_mode
+    }
+
+@app.route('/api/attendance/jobs', methods=['POST'])
+def api_attendance_jobs():
+    # Accept an upload and process it in the background; the client polls or listens for the result
+    if 'image' not in request.files:
+        return jsonify({'error': 'No file part'}), 400
+    
+    file = request.files['image']
+    if file.filename == '':
+        return jsonify({'error': 'No selected file'}), 400
+    
+    with metrics.stage('upload_read'):
+        image_data = file.read()
+    upload_hash = content_hash(image_data)
+    attendance_mode = request.form.get('mode', 'individual')
+    
+    try:
+        job_id = get_job_queue().submit(run_attendance_job, image_data, attendance_mode, upload_hash)
+    except QueueFullError as e:
+        response = jsonify({'error': str(e)})
+        response.headers['Retry-After'] = '2'
+        return response, 429
+    
+    return jsonify({
+        'jobId': job_id,
+        'statusUrl': url_for('api_attendance_job_status', job_id=job_id),
+        'eventsUrl': url_for('api_attendance_job_events', job_id=job_id)
+    }), 202
+
+@app.route('/api/attendance/sessions', methods=['POST'])
+def api_attendance_sessions():
+    # Several overlapping photos of one room in one request, recorded as a single group session
+    files = [file for file in request.files.getlist('images') if file.filename != '']
+    if not files:
+        return jsonify({'error': 'No images uploaded'}), 400
+    if len(files) > SESSION_MAX_IMAGES:
+        return jsonify({'error': f"At most {SESSION_MAX_IMAGES} images per session"}), 413
+    
+    with metrics.stage('upload_read'):
+        images = [file.read() for file in files]
+    start = time.perf_counter()
+    results_text, recognized_users, photos = process_attendance_session(images)
+    for photo, file in zip(photos, files):
+        photo['filename'] = file.filename
+    
+    return jsonify({
+        'results': results_text,
+        'recognizedUsers': recognized_users,
+        'photos': photos,
+        'seconds': round(time.perf_counter() - start, 3)
+    })
+
+@app.route('/api/attendance/jobs/<job_id>')
+def api_attendance_job_status(job_id):
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job)
+
+@app.route('/api/attendance/jobs/<job_id>/events')
+def api_attendance_job_events(job_id):
+    # Server-sent events: a status event now, then the final result when the job finishes
+    job_queue = get_job_queue()
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    
+    def generate():
+        current = job
+        yield f"event: status\ndata: {json.dumps(current)}\n\n"
+        while current is not None and current['finished_at'] is None:
+            current = job_queue.wait(job_id, timeout=15)
+            if current is not None and current['finished_at'] is None:
+                # Comment line keeps proxies from closing an idle connection
+                yield ": keep-alive\n\n"
+        if current is not None:
+            yield f"event: result\ndata: {json.dumps(current)}\n\n"
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/stream/sessions', methods=['POST'])
+def api_stream_session_create():
+    # Start a stream session; frames are then posted to it in chunks
+    fps = request.form.get('fps', type=float) or request.args.get('fps', type=float)
+    session = StreamSession(
+        detect_fn=get_detector().detect,
+        embed_fn=embed_crops,
+        match_fn=get_gallery().match,
+        record_fn=record_attendance_batch,
+        **({'target_fps': fps} if fps else {})
+    )
+    stream_sessions.add(session)
+    return jsonify({
+        'sessionId': session.id,
+        'framesUrl': url_for('api_stream_session_frames', session_id=session.id),
+        'videoUrl': url_for('api_stream_session_video', session_id=session.id)
+    }), 201
+
+@app.route('/api/stream/sessions/<session_id>/frames', methods=['POST'])
+def api_stream_session_frames(session_id):
+    # Accept a chunk of JPEG frames, in order, as repeated 'frame' files
+    session = stream_sessions.get(session_id)
+    if session is None:
+        return jsonify({'error': 'Unknown stream session'}), 404
+    
+    frames = request.files.getlist('frame')
+    if not frames:
+        return jsonify({'error': 'No frames uploaded'}), 400
+    
+    records = []
+    for frame_file in frames:
+        frame = decode_frame(frame_file.read())
+        if frame is None:
+            continue
+        records.extend(session.process_frame(frame))
+    
+    return jsonify({'marked': records, 'session': session.summary()})
+
+@app.route('/api/stream/sessions/<session_id>/video', methods=['POST'])
+def api_stream_session_video(session_id):
+    # Process an uploaded video file as a background job
+    session = stream_sessions.get(session_id)
+    if session is None:
+        return jsonify({'error': 'Unknown stream session'}), 404
+    
+    if 'video' not in request.files or request.files['video'].filename == '':
+        return jsonify({'error': 'No video uploaded'}), 400
+    
+    video = request.files['video']
+    video_path = os.path.join(uploads_dir, secure_filename(f"{session.id}_{video.filename}"))
+    video.save(video_path)
+    
+    def run_video_job():
+        try:
+            session.process_video(video_path)
+            return session.summary()
+        finally:
+            os.remove(video_path)
+    
+    try:
+        job_id = get_job_queue().submit(run_video_job)
+    except QueueFullError as e:
+        os.remove(video_path)
+        response = jsonify({'error': str(e)})
+        response.headers['Retry-After'] = '2'
+        return response, 429
+    
+    return jsonify({
+        'jobId': job_id,
+        'statusUrl': url_for('api_attendance_job_status', job_id=job_id)
+    }), 202
+
+@app.route('/api/stream/sessions/<session_id>', methods=['GET', 'DELETE'])
+def api_stream_session(session_id):
+    # Current tracking state, or close the session and return its final summary
+    if request.method == 'DELETE':
+        session = stream_sessions.remove(session_id)
+    else:
+        session = stream_sessions.get(session_id)
+    if session is None:
+        return jsonify({'error': 'Unknown stream session'}), 404
+    return jsonify(session.summary())
+
 @app.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
@@ -179,38 +539,33 @@ def register():
         if photo.filename == '':
             return render_template('register.html', error='No photo selected')
         
-        # Save the photo
-        filename = secure_filename(f"{username}_{int(time.time())}.jpg")
-        photo_path = os.path.join(uploads_dir, filename)
-        photo.save(photo_path)
+        # The photo is processed from memory; only a face crop and thumbnail are kept
+        photo_data = photo.read()
         
         # Process the face for recognition
         try:
-            # In a real system, you would extract face embeddings here
-            # For this demo, we'll just use the image classification results
-            results = face_recognition(photo_path)
-            face_id = results[0]['label'] if results else "unknown"
-            
-            # Load existing users
-            users = []
-            if os.path.exists(users_db_path):
-                with open(users_db_path, 'r') as f:
-                    users = json.load(f)
+            # Enroll the face embedding so /attendance can match this user
+            # (using the largest face if the photo contains more than one);
+            # a photo without a detected face is rejected rather than enrolled whole
+            embeddings, positions = embed_faces(photo_data)
+            if not positions:
+                raise ValueError("No usable face found; use a sharper, well-lit photo")
+            largest = max(range(len(positions)), key=lambda i: positions[i]['width'] * positions[i]['height'])
+            photo_paths = save_media('registration', photo_data, [(username, positions[largest])])
             
             # Add new user
             new_user = {
                 'username': username,
                 'email': email,
-                'face_id': face_id,
-                'photo_path': photo_path,
+                'photo_path': photo_paths[0] if photo_paths else '',
                 'registered_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
             }
             
-            users.append(new_user)
-            
-            # Save updated users list
-            with open(users_db_path, 'w') as f:
-                json.dump(users, f, indent=4)
+            # Save the user; this writes through the in-process user cache
+            user_directory.add_user(new_user)
+            # Enroll last, so a failed registration never leaves a gallery row
+            # that /attendance would match to a user missing from users.json
+            get_gallery().enroll(username, embeddings[largest])
             
             return render_template('register.html', success=f"User {username} registered successfully!")
         except Exception as e:
@@ -218,49 +573,117 @@ def register():
     
     return render_template('register.html')
 
-def recognize_faces(image_path):
-    # Load image and perform recognition
-    results = face_recognition(image_path)
-    return results
-
 def record_attendance(username):
-    # Load existing attendance records
-    attendance_records = []
-    if os.path.exists(attendance_db_path):
-        with open(attendance_db_path, 'r') as f:
-            attendance_records = json.load(f)
-    
-    # Add new attendance record
-    new_record = {
-        'username': username,
-        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-        'date': datetime.now().strftime('%Y-%m-%d')
-    }
-    
-    attendance_records.append(new_record)
-    
-    # Save updated attendance records
-    with open(attendance_db_path, 'w') as f:
-        json.dump(attendance_records, f, indent=4)
+    # Append a single attendance record
+    return attendance_store.record(username)
+
+def record_attendance_batch(usernames):
+    # Record several users in one transaction (used for group photos)
+    return attendance_store.record_many(usernames)
 
 # API routes for real-time data
 
+def data_version():
+    """
+    Version and last-modified time of everything the dashboard APIs read
+    Reports are relative to today, so the date is part of the version too.
+    """
+    writes, last_write = attendance_store.data_version()
+    users_signature = user_directory.data_version()
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    last_modified = max(last_write, users_signature[0] // 10**9 if users_signature else 0, int(today.timestamp()))
+    return (writes, users_signature, today.strftime('%Y-%m-%d')), datetime.fromtimestamp(last_modified)
+
+def cached_api(view):
+    """
+    Serve a read-only API through the response cache with ETag and Last-Modified
+    A request whose If-None-Match matches the current data version gets a 304
+    without the view running at all.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        version, last_modified = data_version()
+        key = (request.path, tuple(sorted(request.args.items(multi=True))))
+        if request.if_none_match.contains(make_etag(key, version)):
+            response_cache.count_not_modified()
+            response = Response(status=304)
+            response.set_etag(make_etag(key, version))
+            response.last_modified = last_modified
+            response.cache_control.no_cache = True
+            return response
+        
+        entry = response_cache.get(key, version)
+        if entry is None:
+            rendered = app.make_response(view(*args, **kwargs))
+            if rendered.status_code != 200:
+                return rendered
+            entry = response_cache.put(key, version, rendered.get_data(), rendered.mimetype)
+        
+        response = Response(entry['body'], mimetype=entry['mimetype'])
+        response.set_etag(entry['etag'])
+        response.last_modified = last_modified
+        # Browsers may keep the body but must revalidate it on every use
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+    return wrapper
+
+def chart_response(labels, data):
+    # Chart.js payload shared by every report type
+    return jsonify({
+        'labels': labels,
+        'datasets': [{
+            'label': 'Attendance Rate (%)',
+            'data': data,
+            'backgroundColor': 'rgba(52, 152, 219, 0.5)',
+            'borderColor': 'rgba(52, 152, 219, 1)',
+            'borderWidth': 1
+        }]
+    })
+
+def last_months(count):
+    # (year, month) pairs for the last `count` months, oldest first, ending with the current month
+    today = datetime.now()
+    year, month = today.year, today.month
+    months = []
+    for _ in range(count):
+        months.append((year, month))
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+    return list(reversed(months))
+
+def month_range(year, month):
+    # First and last date of a month as YYYY-MM-DD strings
+    next_month = datetime(year + 1, 1, 1) if month == 12 else datetime(year, month + 1, 1)
+    return f"{year:04d}-{month:02d}-01", (next_month - timedelta(days=1)).strftime('%Y-%m-%d')
+
+def monthly_presence(months):
+    # Per-month present/absent/late counts from the daily aggregates
+    total_users = attendance_store.user_count()
+    start_date = month_range(*months[0])[0]
+    end_date = month_range(*months[-1])[1]
+    daily = attendance_store.daily_totals(start_date, end_date)
+    
+    present, absent, late = [], [], []
+    for year, month in months:
+        prefix = f"{year:04d}-{month:02d}"
+        days = [totals for date, totals in daily.items() if date.startswith(prefix)]
+        users_present = sum(totals['users'] for totals in days)
+        users_late = sum(totals['late'] for totals in days)
+        present.append(users_present - users_late)
+        late.append(users_late)
+        # Every known user is expected on each day that attendance was taken
+        absent.append(max(0, total_users * len(days) - users_present))
+    return present, absent, late
+
 @app.route('/api/attendance/summary')
+@cached_api
 def api_attendance_summary():
-    # Get attendance data for the current user
-    attendance_records = []
-    if os.path.exists(attendance_db_path):
-        with open(attendance_db_path, 'r') as f:
-            attendance_records = json.load(f)
-    
     # Filter records for the current user (in a real app, you'd use session data)
     # For demo, we'll use the first username in the records
-    username = attendance_records[0]['username'] if attendance_records else 'default_user'
-    user_records = [record for record in attendance_records if record['username'] == username]
+    username = attendance_store.first_username() or 'default_user'
     
-    # Calculate statistics
+    # Calculate statistics from the per-user aggregate
     total_days = 30  # This would be calculated based on the current month
-    present_days = len(set([record['date'] for record in user_records]))
+    present_days = attendance_store.user_days_present(username)
     absent_days = total_days - present_days
     attendance_percentage = round((present_days / total_days) * 100) if total_days > 0 else 0
     
@@ -272,29 +695,19 @@ def api_attendance_summary():
     })
 
 @app.route('/api/user/profile')
+@cached_api
 def api_user_profile():
     # Get user data (in a real app, you'd use session data)
-    users = []
-    if os.path.exists(users_db_path):
-        with open(users_db_path, 'r') as f:
-            users = json.load(f)
-    
     # For demo, we'll use the first user in the database
-    user = users[0] if users else {
+    user = user_directory.first_user() or {
         'username': 'John Doe',
         'role': 'Student',
         'email': 'john.doe@example.com',
         'department': 'Computer Science'
     }
     
-    # Get attendance data for calculating statistics
-    attendance_records = []
-    if os.path.exists(attendance_db_path):
-        with open(attendance_db_path, 'r') as f:
-            attendance_records = json.load(f)
-    
-    user_records = [record for record in attendance_records if record['username'] == user['username']]
-    days_present = len(set([record['date'] for record in user_records]))
+    # Days present come straight from the per-user aggregate
+    days_present = attendance_store.user_days_present(user['username'])
     attendance_percentage = round((days_present / 30) * 100)  # Assuming 30 days in a month
     
     # Add profile image path
@@ -311,146 +724,204 @@ def api_user_profile():
     })
 
 @app.route('/api/reports/data')
+@cached_api
 def api_reports_data():
     report_type = request.args.get('type', '')
-    
-    # Get attendance data
-    attendance_records = []
-    if os.path.exists(attendance_db_path):
-        with open(attendance_db_path, 'r') as f:
-            attendance_records = json.load(f)
+    total_users = attendance_store.user_count()
+    today = datetime.now()
     
     # Process data based on report type
     if 'Weekly' in report_type:
         # Get data for the current week
-        today = datetime.now()
         start_of_week = today - timedelta(days=today.weekday())
         days = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday']
+        dates = [(start_of_week + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(5)]
+        daily = attendance_store.daily_totals(dates[0], dates[-1])
         
-        # Count attendance for each day
-        data = [0, 0, 0, 0, 0]  # Default values
-        for record in attendance_records:
-            record_date = datetime.strptime(record['date'], '%Y-%m-%d')
-            if record_date >= start_of_week:
-                weekday = record_date.weekday()
-                if weekday < 5:  # Monday to Friday
-                    data[weekday] += 1
-        
-        # Calculate percentages
-        total_users = len(set([record['username'] for record in attendance_records]))
+        # Distinct users present on each day, as a percentage of all users
+        data = [daily.get(date, {}).get('users', 0) for date in dates]
         if total_users > 0:
             data = [round((count / total_users) * 100) for count in data]
         
-        return jsonify({
-            'labels': days,
-            'datasets': [{
-                'label': 'Attendance Rate (%)',
-                'data': data,
-                'backgroundColor': 'rgba(52, 152, 219, 0.5)',
-                'borderColor': 'rgba(52, 152, 219, 1)',
-                'borderWidth': 1
-            }]
-        })
+        return chart_response(days, data)
     
-    elif 'Monthly' in report_type:
-        # Get data for the current month
-        today = datetime.now()
-        weeks = ['Week 1', 'Week 2', 'Week 3', 'Week 4']
+    elif 'Department' in report_type:
+        # Share of expected check-ins this month made by each department's users
+        start_date, end_date = month_range(today.year, today.month)
+        active_days = len(attendance_store.daily_totals(start_date, end_date))
         
-        # Count attendance for each week
-        data = [0, 0, 0, 0]  # Default values
-        for record in attendance_records:
-            record_date = datetime.strptime(record['date'], '%Y-%m-%d')
-            if record_date.month == today.month and record_date.year == today.year:
-                # Determine which week of the month
-                day = record_date.day
-                week_index = min(3, (day - 1) // 7)
-                data[week_index] += 1
+        # A re-registered user counts once, in the department of their latest registration
+        department_sizes = {}
+        user_departments = {}
+        for username, user in user_directory.latest_users().items():
+            department = user.get('department') or 'Unassigned'
+            user_departments[username] = department
+            department_sizes[department] = department_sizes.get(department, 0) + 1
         
-        # Calculate percentages
-        total_users = len(set([record['username'] for record in attendance_records]))
-        if total_users > 0:
-            data = [round((count / total_users) * 100) for count in data]
+        present = {department: 0 for department in department_sizes}
+        for date, username in attendance_store.presence_between(start_date, end_date):
+            department = user_departments.get(username)
+            if department is not None:
+                present[department] += 1
         
-        return jsonify({
-            'labels': weeks,
-            'datasets': [{
-                'label': 'Attendance Rate (%)',
-                'data': data,
-                'backgroundColor': 'rgba(52, 152, 219, 0.5)',
-                'borderColor': 'rgba(52, 152, 219, 1)',
-                'borderWidth': 1
-            }]
-        })
-    
-    elif 'Department' in report_type:
-        # This would require department data for each user
-        # For demo, we'll use sample departments
-        departments = ['CS Dept', 'Engineering', 'Business', 'Arts', 'Sciences']
-        data = [95, 88, 82, 78, 90]  # Sample data
+        departments = sorted(department_sizes)
+        data = []
+        for department in departments:
+            expected = department_sizes[department] * active_days
+            data.append(round((present[department] / expected) * 100) if expected > 0 else 0)
         
-        return jsonify({
-            'labels': departments,
-            'datasets': [{
-                'label': 'Attendance Rate (%)',
-                'data': data,
-                'backgroundColor': 'rgba(52, 152, 219, 0.5)',
-                'borderColor': 'rgba(52, 152, 219, 1)',
-                'borderWidth': 1
-            }]
-        })
+        return chart_response(departments, data)
     
     elif 'Trends' in report_type:
         # Get data for the last 6 months
-        months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun']
-        data = [75, 82, 88, 90, 92, 95]  # Sample data
+        months = last_months(6)
+        present, absent, late = monthly_presence(months)
+        data = []
+        for on_time, missed, late_count in zip(present, absent, late):
+            expected = on_time + missed + late_count
+            data.append(round(((on_time + late_count) / expected) * 100) if expected > 0 else 0)
         
-        return jsonify({
-            'labels': months,
-            'datasets': [{
-                'label': 'Attendance Rate (%)',
-                'data': data,
-                'backgroundColor': 'rgba(52, 152, 219, 0.5)',
-                'borderColor': 'rgba(52, 152, 219, 1)',
-                'borderWidth': 1
-            }]
-        })
+        return chart_response([datetime(year, month, 1).strftime('%b') for year, month in months], data)
     
-    # Default response
-    return jsonify({
-        'labels': ['Week 1', 'Week 2', 'Week 3', 'Week 4'],
-        'datasets': [{
-            'label': 'Attendance Rate (%)',
-            'data': [85, 92, 88, 95],
-            'backgroundColor': 'rgba(52, 152, 219, 0.5)',
-            'borderColor': 'rgba(52, 152, 219, 1)',
-            'borderWidth': 1
-        }]
-    })
+    # Monthly report (also the default): get data for the current month
+    weeks = ['Week 1', 'Week 2', 'Week 3', 'Week 4']
+    daily = attendance_store.daily_totals(*month_range(today.year, today.month))
+    
+    # Count users present and days with attendance for each week
+    data = [0, 0, 0, 0]  # Default values
+    active_days = [0, 0, 0, 0]
+    for date, totals in daily.items():
+        # Determine which week of the month
+        day = int(date[8:10])
+        week_index = min(3, (day - 1) // 7)
+        data[week_index] += totals['users']
+        active_days[week_index] += 1
+    
+    # Calculate percentages of the check-ins expected on those days
+    data = [round((count / (total_users * days)) * 100) if total_users > 0 and days > 0 else 0
+            for count, days in zip(data, active_days)]
+    
+    return chart_response(weeks, data)
 
 @app.route('/api/attendance/overview')
+@cached_api
 def api_attendance_overview():
-    # Get attendance data
-    attendance_records = []
-    if os.path.exists(attendance_db_path):
-        with open(attendance_db_path, 'r') as f:
-            attendance_records = json.load(f)
-    
-    # Process data for the last 6 months
-    months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun']
-    present_data = [20, 18, 22, 19, 21, 23]  # Sample data
-    absent_data = [2, 4, 0, 3, 1, 0]  # Sample data
-    late_data = [3, 2, 3, 2, 3, 2]  # Sample data
-    
-    # In a real implementation, you would calculate these values from actual attendance records
+    # Present, absent and late counts for the last 6 months, from the daily aggregates
+    months = last_months(6)
+    present_data, absent_data, late_data = monthly_presence(months)
     
     return jsonify({
-        'labels': months,
+        'labels': [datetime(year, month, 1).strftime('%b') for year, month in months],
         'present': present_data,
         'absent': absent_data,
         'late': late_data
     })
 
+def parse_range_args():
+    # Date range and user filters shared by the records and export endpoints
+    start_date = request.args.get('start', '0001-01-01')
+    end_date = request.args.get('end', '9999-12-31')
+    for value in (start_date, end_date):
+        datetime.strptime(value, '%Y-%m-%d')
+    return start_date, end_date, request.args.get('username') or None
+
+@app.route('/api/attendance/records')
+def api_attendance_records():
+    # Paginated attendance history; pass nextCursor back as ?cursor= for the next page
+    try:
+        start_date, end_date, username = parse_range_args()
+        limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+        after = None
+        cursor = request.args.get('cursor')
+        if cursor:
+            cursor_date, cursor_id = cursor.split(':')
+            after = (cursor_date, int(cursor_id))
+    except ValueError:
+        return jsonify({'error': 'Invalid date range or cursor'}), 400
+    
+    records, next_after = attendance_store.query(start_date, end_date, username, after, limit)
+    return jsonify({
+        'records': records,
+        'nextCursor': f"{next_after[0]}:{next_after[1]}" if next_after else None
+    })
+
+@app.route('/api/attendance/export')
+def api_attendance_export():
+    # Stream matching records as CSV or JSONL without loading them all into memory
+    try:
+        start_date, end_date, username = parse_range_args()
+    except ValueError:
+        return jsonify({'error': 'Invalid date range'}), 400
+    
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ('csv', 'jsonl'):
+        return jsonify({'error': 'format must be csv or jsonl'}), 400
+    
+    def generate():
+        records = attendance_store.iter_records(start_date, end_date, username)
+        if export_format == 'jsonl':
+            for record in records:
+                yield json.dumps(record) + '\n'
+            return
+        
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(['username', 'date', 'timestamp'])
+        for count, record in enumerate(records, 1):
+            writer.writerow([record['username'], record['date'], record['timestamp']])
+            # Send rows in chunks rather than one tiny write per record
+            if count % 500 == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+    
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    filename = f"attendance_{start_date}_{end_date}.{export_format}"
+    return Response(stream_with_context(generate()), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+@app.route('/api/health/ready')
+def api_health_ready():
+    # Readiness probe: only route recognition traffic here once the model is warm.
+    # With lazy loading nothing else would start the load, so the first probe does.
+    if not model_registry.is_ready():
+        model_registry.warm_up(background=True)
+    stats = model_registry.model_stats()
+    status_code = 200 if model_registry.is_ready() else 503
+    return jsonify({'ready': model_registry.is_ready(), 'model': stats}), status_code
+
+@app.route('/api/model/warmup', methods=['POST'])
+def api_model_warmup():
+    # Trigger a background model load without waiting for the first recognition request
+    if not model_registry.is_ready():
+        model_registry.warm_up(background=True)
+    return jsonify({'ready': model_registry.is_ready(), 'model': model_registry.model_stats()}), 202
+
+@app.route('/api/cache/stats')
+def api_cache_stats():
+    return jsonify({
+        'users': user_directory.stats(),
+        'recognition': recognition_cache.stats(),
+        'responses': response_cache.stats()
+    })
+
+@app.route('/api/media/stats')
+def api_media_stats():
+    # Disk usage of the media store and the result of its last compaction
+    if media_store is None:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, **media_store.stats()})
+
+@app.route('/api/inference/stats')
+def api_inference_stats():
+    # Queue depth, batch sizes and per-stage waits of the shared embedding worker
+    return jsonify(get_inference_worker().stats())
+
+@app.route('/api/attendance/jobs/stats')
+def api_attendance_job_stats():
+    return jsonify(get_job_queue().stats())
+
 @app.route('/attendance_summary')
 def attendance_summary():
     return render_template('attendance_summary.html')
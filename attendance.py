@@ -1,73 +1,173 @@
-from transformers import pipeline
 import cv2
 import numpy as np
+import io
 import os
+import threading
+from PIL import Image
+from model_registry import get_model
+from face_detector import get_detector
+from face_quality import filter_faces
+from inference_worker import MicroBatcher
+import metrics
 
-# Load the image classification model for individual recognition
-face_recognition = pipeline('image-classification', model='microsoft/resnet-50')
+# Number of face crops sent to the model in a single forward pass
+FACE_BATCH_SIZE = int(os.environ.get('FAS_FACE_BATCH_SIZE', 16))
 
-def recognize_faces(image_path):
-    # Load image and perform recognition
-    results = face_recognition(image_path)
-    return results
+# How long the shared inference worker waits to fill a batch from concurrent requests
+MICROBATCH_MAX_WAIT_MS = float(os.environ.get('FAS_MICROBATCH_MAX_WAIT_MS', 5))
+MICROBATCH_ENABLED = os.environ.get('FAS_MICROBATCH', '1') == '1'
+# Longest a request waits for the worker's embeddings; it covers a model load on first use
+MICROBATCH_TIMEOUT = float(os.environ.get('FAS_MICROBATCH_TIMEOUT', 120))
 
-def recognize_multiple_faces(image_path):
+# Uploads are decoded at reduced resolution, but never below this many pixels on the longest side,
+# nor so far that the detector would miss faces of its minimum size (FAS_DETECT_MIN_FACE)
+DECODE_MIN_SIDE = int(os.environ.get('FAS_DECODE_MIN_SIDE', 1280))
+
+# cv2 flags for decoding a JPEG at 1/2, 1/4 and 1/8 scale directly from the compressed data
+_REDUCED_DECODE_FLAGS = [
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2)
+]
+
+_worker = None
+_worker_lock = threading.Lock()
+
+def load_image(source, max_reduction=float('inf')):
     """
-    Recognize multiple faces in a single image for group attendance
-    Uses OpenCV for face detection and then applies recognition on each detected face
+    Load a BGR image from a file path, or decode it straight from upload bytes
+    Bytes are decoded at the largest reduction, up to max_reduction, that keeps
+    the image at least DECODE_MIN_SIDE pixels on its longest side. Returns
+    (image, scale), where scale converts reduced coordinates back to the
+    original resolution.
     """
-    # Load the image
-    image = cv2.imread(image_path)
-    if image is None:
-        return [{"label": "Error: Could not load image", "score": 0}]
+    if isinstance(source, str):
+        return cv2.imread(source), 1
     
-    # Convert to grayscale for face detection
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    buffer = np.frombuffer(memoryview(source), dtype=np.uint8)
+    try:
+        # Only the header is read here; the pixels are decoded by cv2 below
+        width, height = Image.open(io.BytesIO(source)).size
+    except Exception:
+        width = height = 0
     
-    # Load OpenCV's pre-trained face detector
-    face_cascade_path = os.path.join(cv2.data.haarcascades, 'haarcascade_frontalface_default.xml')
-    if not os.path.exists(face_cascade_path):
-        # Fallback to a local path if the OpenCV path doesn't work
-        face_cascade_path = 'haarcascade_frontalface_default.xml'
-        if not os.path.exists(face_cascade_path):
-            return [{"label": "Error: Face cascade file not found", "score": 0}]
+    for factor, flag in _REDUCED_DECODE_FLAGS:
+        if factor <= max_reduction and max(width, height) // factor >= DECODE_MIN_SIDE:
+            image = cv2.imdecode(buffer, flag)
+            if image is not None:
+                return image, max(width, height) / max(image.shape[:2])
+    return cv2.imdecode(buffer, cv2.IMREAD_COLOR), 1
+
+def load_face_crops(source, whole_image_fallback=False):
+    """
+    Detect faces in an image and crop each one in memory as an RGB PIL image
+    source is a file path or the raw bytes of an upload. Positions are given in
+    the original image's coordinates. Detections that fail the quality gate are
+    dropped before cropping. With whole_image_fallback, an image with no
+    detected face is returned as a single crop.
+    Returns (crops, positions), or (None, error message) if the image cannot be processed
+    """
+    # The shared detector is loaded once per process
+    try:
+        detector = get_detector()
+    except FileNotFoundError as e:
+        return None, str(e)
+    
+    # Load the image, no smaller than the detector needs
+    with metrics.stage('decode'):
+        image, scale = load_image(source, max_reduction=detector.max_reduction())
+    if image is None:
+        return None, "Could not load image"
     
-    face_cascade = cv2.CascadeClassifier(face_cascade_path)
+    with metrics.stage('detect'):
+        faces = detector.detect(image, scale)
+    metrics.observe_faces(len(faces))
     
-    # Detect faces
-    faces = face_cascade.detectMultiScale(gray, 1.1, 4)
+    if len(faces):
+        # Drop detections that would only waste a forward pass
+        with metrics.stage('quality'):
+            faces, skipped = filter_faces(image, faces, scale)
+        metrics.observe_skipped(skipped)
+    elif whole_image_fallback:
+        faces = [(0, 0, image.shape[1], image.shape[0])]
     
-    # If no faces detected, return the original image classification result
-    if len(faces) == 0:
-        return face_recognition(image_path)
+    # Crop every remaining face in memory; the pipeline expects RGB images
     
-    # Process each detected face
-    results = []
-    for i, (x, y, w, h) in enumerate(faces):
-        # Extract the face region
+    positions = []
+    crops = []
+    for (x, y, w, h) in faces:
+        positions.append({'x': int(round(x * scale)), 'y': int(round(y * scale)),
+                          'width': int(round(w * scale)), 'height': int(round(h * scale))})
         face_img = image[y:y+h, x:x+w]
-        
-        # Save the face temporarily
-        temp_face_path = f"temp_face_{i}.jpg"
-        cv2.imwrite(temp_face_path, face_img)
-        
-        try:
-            # Recognize this face
-            face_result = face_recognition(temp_face_path)
-            
-            # Add position information to help with identification
-            if isinstance(face_result, list) and len(face_result) > 0:
-                face_result[0]['position'] = {'x': x, 'y': y, 'width': w, 'height': h}
-                results.append(face_result[0])
-            else:
-                results.append({"label": "Unknown", "score": 0, 
-                               'position': {'x': x, 'y': y, 'width': w, 'height': h}})
-        except Exception as e:
-            results.append({"label": f"Error: {str(e)}", "score": 0,
-                           'position': {'x': x, 'y': y, 'width': w, 'height': h}})
-        finally:
-            # Clean up the temporary file
-            if os.path.exists(temp_face_path):
-                os.remove(temp_face_path)
+        crops.append(Image.fromarray(cv2.cvtColor(face_img, cv2.COLOR_BGR2RGB)))
+    
+    return crops, positions
+
+def embed_images(images, batch_size=FACE_BATCH_SIZE):
+    """
+    Compute a fixed-length embedding for each PIL image using the shared model's backbone
+    The last feature map is average-pooled, giving one float32 vector per image
+    """
+    model = get_model()
+    embeddings = []
+    for start in range(0, len(images), batch_size):
+        batch = images[start:start + batch_size]
+        metrics.observe_batch(len(batch))
+        with metrics.stage('embed'):
+            embeddings.append(_embed_batch(model, batch))
+    
+    if not embeddings:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.concatenate(embeddings)
+
+def _embed_batch(model, batch):
+    if hasattr(model, 'embed'):
+        # Models that compute embeddings themselves (stubs, exported backends)
+        return np.asarray(model.embed(batch), dtype=np.float32)
+    
+    import torch
     
-    return results
\ No newline at end of file
+    inputs = model.image_processor(images=batch, return_tensors='pt')
+    with torch.no_grad():
+        outputs = model.model(**inputs, output_hidden_states=True)
+    features = outputs.hidden_states[-1]
+    if features.dim() == 4:
+        features = features.mean(dim=(2, 3))
+    return features.cpu().numpy().astype(np.float32)
+
+def embed_faces(source, batch_size=FACE_BATCH_SIZE, whole_image_fallback=False):
+    """
+    Detect and embed every face in an image (file path or upload bytes) for gallery matching
+    With whole_image_fallback, the whole image is embedded when no face is
+    detected; enrollment must not use it, or a photo of a wall becomes an identity
+    Returns (embeddings, positions)
+    """
+    crops, positions = load_face_crops(source, whole_image_fallback=whole_image_fallback)
+    if crops is None:
+        raise ValueError(positions)
+    
+    return embed_crops(crops, batch_size=batch_size), positions
+
+def embed_crops(crops, batch_size=FACE_BATCH_SIZE):
+    """Embed already-cropped faces, going through the shared worker when micro-batching is on"""
+    if not crops:
+        return np.zeros((0, 0), dtype=np.float32)
+    if MICROBATCH_ENABLED:
+        # Share forward passes with faces from other in-flight requests
+        with metrics.stage('embed_queue'):
+            return np.stack(get_inference_worker().run(crops, timeout=MICROBATCH_TIMEOUT))
+    return embed_images(crops, batch_size=batch_size)
+
+def get_inference_worker():
+    """Return the process-wide micro-batching worker that computes face embeddings"""
+    global _worker
+    if _worker is None:
+        with _worker_lock:
+            if _worker is None:
+                _worker = MicroBatcher(
+                    lambda crops: list(embed_images(crops, batch_size=FACE_BATCH_SIZE)),
+                    max_batch_size=FACE_BATCH_SIZE,
+                    max_wait=MICROBATCH_MAX_WAIT_MS / 1000,
+                    name='embedding-worker'
+                )
+    return _worker
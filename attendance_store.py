@@ -0,0 +1,270 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime
+import metrics
+from sqlite_connection import thread_connection
+
+# Arrivals after this time of day count as late in the daily aggregates
+LATE_AFTER = os.environ.get('FAS_LATE_AFTER', '09:15:00')
+
+_base_dir = os.path.dirname(os.path.abspath(__file__))
+ATTENDANCE_DB_PATH = os.path.join(_base_dir, 'data', 'attendance.db')
+LEGACY_JSON_PATH = os.path.join(_base_dir, 'data', 'attendance.json')
+
+class AttendanceStore:
+    """
+    SQLite-backed attendance log in WAL mode
+    Each mark is a single-row insert, so writing is O(1) regardless of history size,
+    and readers in other threads or processes are never blocked by a writer.
+    Per-day and per-user aggregates are updated in the same transaction as the
+    insert, so the reporting queries never have to scan the full history.
+    """
+
+    def __init__(self, db_path=ATTENDANCE_DB_PATH, legacy_json_path=LEGACY_JSON_PATH):
+        self.db_path = db_path
+        self.legacy_json_path = legacy_json_path
+        self._local = threading.local()
+        self._init_schema()
+
+    def _connect(self):
+        return thread_connection(self._local, self.db_path)
+
+    def _init_schema(self):
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        conn = self._connect()
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS attendance (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    username TEXT NOT NULL,
+                    timestamp TEXT NOT NULL,
+                    date TEXT NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_attendance_date ON attendance (date)')
+            # Range queries and exports walk these indexes in (date, id) order, so a
+            # query only ever touches the rows of the dates (and user) it asked for
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_attendance_username ON attendance (username, date)')
+            conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            # Aggregates: one row per user per day present, per day, and per user
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS daily_presence (
+                    date TEXT NOT NULL,
+                    username TEXT NOT NULL,
+                    records INTEGER NOT NULL,
+                    first_timestamp TEXT NOT NULL,
+                    PRIMARY KEY (date, username)
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS daily_totals (
+                    date TEXT PRIMARY KEY,
+                    records INTEGER NOT NULL,
+                    users INTEGER NOT NULL,
+                    late INTEGER NOT NULL
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS user_totals (
+                    username TEXT PRIMARY KEY,
+                    records INTEGER NOT NULL,
+                    days INTEGER NOT NULL
+                )
+            ''')
+            conn.execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        self._migrate_legacy_json()
+        self._build_aggregates()
+
+    def _migrate_legacy_json(self):
+        """Import data/attendance.json once; the original file is left in place"""
+        if not os.path.exists(self.legacy_json_path):
+            return
+
+        conn = self._connect()
+        # BEGIN IMMEDIATE takes the write lock, so only one process performs the import
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            done = conn.execute("SELECT value FROM meta WHERE key = 'legacy_json_migrated'").fetchone()
+            if done is None:
+                with open(self.legacy_json_path, 'r') as f:
+                    records = json.load(f)
+                self._insert(conn, records)
+                conn.execute("INSERT INTO meta (key, value) VALUES ('legacy_json_migrated', ?)",
+                             (datetime.now().strftime('%Y-%m-%d %H:%M:%S'),))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _build_aggregates(self):
+        """Fill the aggregate tables from existing rows the first time this schema is used"""
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            done = conn.execute("SELECT value FROM meta WHERE key = 'aggregates_built'").fetchone()
+            if done is None:
+                for table in ('daily_presence', 'daily_totals', 'user_totals'):
+                    conn.execute(f'DELETE FROM {table}')
+                conn.execute("DELETE FROM counters WHERE name = 'users'")
+                rows = conn.execute('SELECT username, timestamp, date FROM attendance ORDER BY id')
+                self._update_aggregates(conn, [dict(row) for row in rows])
+                conn.execute("INSERT INTO meta (key, value) VALUES ('aggregates_built', ?)",
+                             (datetime.now().strftime('%Y-%m-%d %H:%M:%S'),))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _insert(self, conn, records):
+        conn.executemany(
+            'INSERT INTO attendance (username, timestamp, date) VALUES (?, ?, ?)',
+            [(r['username'], r['timestamp'], r['date']) for r in records]
+        )
+        if conn.execute("SELECT 1 FROM meta WHERE key = 'aggregates_built'").fetchone():
+            self._update_aggregates(conn, records)
+        # Data version for HTTP caching: bumped in the same transaction as every write
+        conn.execute("INSERT OR IGNORE INTO counters (name, value) VALUES ('writes', 0)")
+        conn.execute("UPDATE counters SET value = value + 1 WHERE name = 'writes'")
+        conn.execute("INSERT OR REPLACE INTO counters (name, value) VALUES ('last_write', ?)", (int(time.time()),))
+
+    def _update_aggregates(self, conn, records):
+        for record in records:
+            username, date, timestamp = record['username'], record['date'], record['timestamp']
+            first_of_day = conn.execute(
+                'INSERT OR IGNORE INTO daily_presence (date, username, records, first_timestamp) VALUES (?, ?, 0, ?)',
+                (date, username, timestamp)
+            ).rowcount == 1
+            conn.execute('UPDATE daily_presence SET records = records + 1 WHERE date = ? AND username = ?',
+                         (date, username))
+
+            is_late = first_of_day and timestamp[11:] > LATE_AFTER
+            conn.execute('INSERT OR IGNORE INTO daily_totals (date, records, users, late) VALUES (?, 0, 0, 0)', (date,))
+            conn.execute('UPDATE daily_totals SET records = records + 1, users = users + ?, late = late + ? WHERE date = ?',
+                         (int(first_of_day), int(is_late), date))
+
+            new_user = conn.execute(
+                'INSERT OR IGNORE INTO user_totals (username, records, days) VALUES (?, 0, 0)', (username,)
+            ).rowcount == 1
+            conn.execute('UPDATE user_totals SET records = records + 1, days = days + ? WHERE username = ?',
+                         (int(first_of_day), username))
+            if new_user:
+                conn.execute("INSERT OR IGNORE INTO counters (name, value) VALUES ('users', 0)")
+                conn.execute("UPDATE counters SET value = value + 1 WHERE name = 'users'")
+
+    def record_many(self, usernames, when=None):
+        """Record attendance for several users in one transaction; returns the new records"""
+        when = when or datetime.now()
+        timestamp = when.strftime('%Y-%m-%d %H:%M:%S')
+        date = when.strftime('%Y-%m-%d')
+        records = [{'username': username, 'timestamp': timestamp, 'date': date} for username in usernames]
+        if not records:
+            return records
+
+        conn = self._connect()
+        with metrics.stage('record'):
+            # Take the write lock up front so the insert never has to upgrade a read lock
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._insert(conn, records)
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        return records
+
+    def record(self, username, when=None):
+        return self.record_many([username], when)[0]
+
+    def all_records(self):
+        """Return every record, oldest first, in the same shape as the old JSON file"""
+        rows = self._connect().execute(
+            'SELECT username, timestamp, date FROM attendance ORDER BY id'
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def query(self, start_date, end_date, username=None, after=None, limit=100):
+        """
+        One page of records in [start_date, end_date], optionally for one user, in (date, id) order
+        after is the (date, id) of the last record of the previous page. Returns
+        (records, next_after), where next_after is None on the last page.
+        """
+        sql = 'SELECT id, username, timestamp, date FROM attendance WHERE date BETWEEN ? AND ?'
+        params = [start_date, end_date]
+        if username:
+            sql += ' AND username = ?'
+            params.append(username)
+        if after is not None:
+            sql += ' AND (date > ? OR (date = ? AND id > ?))'
+            params.extend([after[0], after[0], after[1]])
+        sql += ' ORDER BY date, id LIMIT ?'
+        params.append(limit + 1)
+
+        rows = self._connect().execute(sql, params).fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        next_after = (rows[-1]['date'], rows[-1]['id']) if has_more else None
+        return [{'username': row['username'], 'timestamp': row['timestamp'], 'date': row['date']}
+                for row in rows], next_after
+
+    def iter_records(self, start_date, end_date, username=None, chunk_size=1000):
+        """Yield every matching record, fetching one page at a time so memory use stays constant"""
+        after = None
+        while True:
+            records, after = self.query(start_date, end_date, username, after, chunk_size)
+            yield from records
+            if after is None:
+                return
+
+    def first_username(self):
+        row = self._connect().execute('SELECT username FROM attendance ORDER BY id LIMIT 1').fetchone()
+        return row['username'] if row else None
+
+    def user_count(self):
+        """Number of distinct users who have ever been marked present"""
+        row = self._connect().execute("SELECT value FROM counters WHERE name = 'users'").fetchone()
+        return row['value'] if row else 0
+
+    def data_version(self):
+        """
+        Return (writes, last write as a Unix time) for the whole store
+        Both come from the database, so every process sees the same version.
+        """
+        rows = self._connect().execute(
+            "SELECT name, value FROM counters WHERE name IN ('writes', 'last_write')"
+        ).fetchall()
+        values = {row['name']: row['value'] for row in rows}
+        return values.get('writes', 0), values.get('last_write', 0)
+
+    def user_days_present(self, username):
+        row = self._connect().execute('SELECT days FROM user_totals WHERE username = ?', (username,)).fetchone()
+        return row['days'] if row else 0
+
+    def daily_totals(self, start_date, end_date):
+        """Return {date: {records, users, late}} for each day with attendance in [start_date, end_date]"""
+        rows = self._connect().execute(
+            'SELECT date, records, users, late FROM daily_totals WHERE date BETWEEN ? AND ?',
+            (start_date, end_date)
+        ).fetchall()
+        return {row['date']: {'records': row['records'], 'users': row['users'], 'late': row['late']} for row in rows}
+
+    def presence_between(self, start_date, end_date):
+        """Return (date, username) pairs for every user present on each day in [start_date, end_date]"""
+        rows = self._connect().execute(
+            'SELECT date, username FROM daily_presence WHERE date BETWEEN ? AND ?',
+            (start_date, end_date)
+        ).fetchall()
+        return [(row['date'], row['username']) for row in rows]
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    """Return the process-wide attendance store, creating the database on first use"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = AttendanceStore()
+    return _store
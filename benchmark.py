@@ -0,0 +1,300 @@
+"""
+Offline benchmarks for the recognition and reporting hot paths
+
+    python benchmark.py --output bench.json
+    python benchmark.py --sizes 1000 10000 100000 1000000 --output bench.json
+    python benchmark.py --compare old.json new.json
+
+Runs against a stub model (no download, deterministic embeddings) and
+synthetic users.json / attendance.json data in a temporary directory, so
+nothing under data/ is touched. Results are written as JSON, one entry per
+benchmark and parameter set, and --compare reports the change between two
+result files.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+import cv2
+import numpy as np
+
+_base_dir = os.path.dirname(os.path.abspath(__file__))
+SAMPLE_FACE = os.path.join(_base_dir, 'uploads', 'photo.jpg')
+
+class StubModel:
+    """
+    Stand-in for the recognition pipeline with a fixed, configurable cost
+    Embeddings are 64-dim thumbnails of the input, so equal images embed equally
+    """
+
+    def __init__(self, latency_ms=0.0, per_image_ms=0.0):
+        self.latency = latency_ms / 1000
+        self.per_image = per_image_ms / 1000
+
+    def _work(self, count):
+        if self.latency or self.per_image:
+            time.sleep(self.latency + self.per_image * count)
+
+    def embed(self, images):
+        self._work(len(images))
+        vectors = []
+        for image in images:
+            gray = cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2GRAY)
+            vectors.append(cv2.resize(gray, (8, 8), interpolation=cv2.INTER_AREA).astype(np.float32).flatten())
+        return np.stack(vectors)
+
+    def __call__(self, inputs, batch_size=None):
+        items = inputs if isinstance(inputs, list) else [inputs]
+        self._work(len(items))
+        results = [[{'label': 'stub', 'score': 1.0}] for _ in items]
+        return results if isinstance(inputs, list) else results[0]
+
+def generate_users(count, seed=0):
+    rng = random.Random(seed)
+    departments = ['CS Dept', 'Engineering', 'Business', 'Arts', 'Sciences']
+    return [{
+        'username': f"user{i:07d}",
+        'email': f"user{i:07d}@example.com",
+        'department': rng.choice(departments),
+        'photo_path': '',
+        'registered_at': '2025-01-01 08:00:00'
+    } for i in range(count)]
+
+def generate_attendance(count, users=1000, days=180, seed=0):
+    """count records spread over the last `days` days by `users` distinct users, oldest first"""
+    rng = random.Random(seed)
+    start = datetime.now() - timedelta(days=days)
+    offsets = sorted(rng.randrange(days * 86400) for _ in range(count))
+    records = []
+    for offset in offsets:
+        when = start + timedelta(seconds=offset)
+        records.append({
+            'username': f"user{rng.randrange(users):07d}",
+            'timestamp': when.strftime('%Y-%m-%d %H:%M:%S'),
+            'date': when.strftime('%Y-%m-%d')
+        })
+    return records
+
+def write_json(path, data):
+    with open(path, 'w') as f:
+        json.dump(data, f)
+
+def group_image(faces, width):
+    """Tile the sample face into a grid of `faces` faces on a canvas `width` pixels wide"""
+    face = cv2.imread(SAMPLE_FACE)
+    columns = max(1, int(np.ceil(np.sqrt(faces))))
+    rows = max(1, int(np.ceil(faces / columns)))
+    cell = width // columns
+    canvas = np.full((cell * rows, cell * columns, 3), 255, dtype=np.uint8)
+    tile = cv2.resize(face, (cell, cell))
+    for i in range(faces):
+        r, c = divmod(i, columns)
+        canvas[r * cell:(r + 1) * cell, c * cell:(c + 1) * cell] = tile
+    return cv2.imencode('.jpg', canvas)[1].tobytes()
+
+def measure(fn, repeat, warmup=1):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        'mean_ms': round(statistics.mean(samples), 4),
+        'p50_ms': round(samples[len(samples) // 2], 4),
+        'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 4),
+        'repeat': repeat
+    }
+
+def bench_recognize_individual(results, repeat, workdir, users=1000):
+    """The individual attendance path: detect and embed the upload, then match it against the gallery"""
+    import attendance
+    from gallery import FaceGallery
+
+    with open(SAMPLE_FACE, 'rb') as f:
+        data = f.read()
+    embeddings, _ = attendance.embed_faces(data, whole_image_fallback=True)
+    rng = np.random.default_rng(0)
+    gallery = FaceGallery(os.path.join(workdir, 'gallery_individual'))
+    gallery.enroll_many([f"user{i:07d}" for i in range(users - 1)],
+                        rng.standard_normal((users - 1, embeddings.shape[1]), dtype=np.float32))
+    gallery.enroll('sample', embeddings)
+
+    def recognize():
+        found, _ = attendance.embed_faces(data, whole_image_fallback=True)
+        return gallery.match(found)
+
+    result = measure(recognize, repeat)
+    result['matched'] = bool(recognize()[0])
+    results.append({'benchmark': 'recognize_individual', 'params': {'users': users}, **result})
+
+def bench_group_recognition(results, repeat, face_counts, widths):
+    import attendance
+
+    for width in widths:
+        for faces in face_counts:
+            data = group_image(faces, width)
+            result = measure(lambda: attendance.embed_faces(data), repeat)
+            result['faces_per_second'] = round(faces / (result['mean_ms'] / 1000), 2)
+            results.append({'benchmark': 'group_recognition', 'params': {'faces': faces, 'width': width}, **result})
+
+def bench_matching(results, repeat, sizes, workdir, faces=40, dim=2048):
+    from gallery import FaceGallery
+
+    rng = np.random.default_rng(0)
+    for size in sizes:
+        gallery = FaceGallery(os.path.join(workdir, f"gallery_{size}"))
+        for start in range(0, size, 10000):
+            count = min(10000, size - start)
+            rows = rng.standard_normal((count, dim), dtype=np.float32)
+            if start == 0:
+                probes = rows[:faces] / np.linalg.norm(rows[:faces], axis=1, keepdims=True)
+            gallery.enroll_many([f"user{i:07d}" for i in range(start, start + count)], rows)
+        # Fit the reduced index up front so it is not built during the timed runs
+        gallery.prepare()
+
+        # Queries are noisy copies of enrolled faces (cosine ~0.93), so recall can be checked;
+        # i.i.d. Gaussian rows have no low-rank structure, the worst case for the PCA scan
+        noise = rng.standard_normal((faces, dim), dtype=np.float32) / np.sqrt(dim)
+        queries = probes + 0.4 * noise
+        result = measure(lambda: gallery.match(queries), repeat)
+        result['ms_per_face'] = round(result['mean_ms'] / faces, 4)
+        matches = gallery.match(queries)
+        result['recall'] = round(float(np.mean([bool(m) and m[0]['username'] == f"user{i:07d}"
+                                                for i, m in enumerate(matches)])), 4)
+        results.append({'benchmark': 'match', 'params': {'users': size, 'faces': faces, 'dim': dim}, **result})
+
+def bench_record_attendance(results, repeat, sizes, workdir):
+    from attendance_store import AttendanceStore
+
+    for size in sizes:
+        json_path = os.path.join(workdir, f"attendance_{size}.json")
+        write_json(json_path, generate_attendance(size))
+        store = AttendanceStore(os.path.join(workdir, f"record_{size}.db"), json_path)
+        result = measure(lambda: store.record('user0000001'), repeat)
+        results.append({'benchmark': 'record_attendance', 'params': {'history': size}, **result})
+        result = measure(lambda: store.record_many([f"user{i:07d}" for i in range(40)]), repeat)
+        results.append({'benchmark': 'record_attendance_group', 'params': {'history': size, 'faces': 40}, **result})
+
+def bench_reports(results, repeat, sizes, workdir):
+    import attendance_store
+    import user_directory
+
+    users_path = os.path.join(workdir, 'users.json')
+    write_json(users_path, generate_users(1000))
+
+    # The app binds its stores at import, so point them at the synthetic data first
+    attendance_store._store = attendance_store.AttendanceStore(os.path.join(workdir, 'reports_empty.db'), '')
+    user_directory._directory = user_directory.UserDirectory(users_path)
+    import app as app_module
+
+    client = app_module.app.test_client()
+    endpoints = [
+        '/api/attendance/summary',
+        '/api/user/profile',
+        '/api/attendance/overview',
+        '/api/reports/data?type=Weekly',
+        '/api/reports/data?type=Monthly',
+        '/api/reports/data?type=Department',
+        '/api/reports/data?type=Trends'
+    ]
+    for size in sizes:
+        json_path = os.path.join(workdir, f"reports_{size}.json")
+        write_json(json_path, generate_attendance(size))
+        app_module.attendance_store = attendance_store.AttendanceStore(os.path.join(workdir, f"reports_{size}.db"), json_path)
+        # Each synthetic store starts at the same data version, so drop responses rendered from the last one
+        app_module.response_cache.clear()
+        for endpoint in endpoints:
+            # 'api' renders every response; 'api_cached' serves unchanged data from the response cache
+            app_module.response_cache.enabled = False
+            result = measure(lambda: client.get(endpoint), repeat)
+            results.append({'benchmark': 'api', 'params': {'endpoint': endpoint, 'history': size}, **result})
+            app_module.response_cache.enabled = True
+            result = measure(lambda: client.get(endpoint), repeat)
+            results.append({'benchmark': 'api_cached', 'params': {'endpoint': endpoint, 'history': size}, **result})
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=_base_dir, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    key = lambda entry: (entry['benchmark'], json.dumps(entry['params'], sort_keys=True))
+    baseline = {key(entry): entry for entry in old['results']}
+    print(f"{old.get('commit')} -> {new.get('commit')}")
+    for entry in new['results']:
+        before = baseline.get(key(entry))
+        if before is None:
+            continue
+        change = (entry['mean_ms'] - before['mean_ms']) / before['mean_ms'] * 100 if before['mean_ms'] else 0.0
+        print(f"{entry['benchmark']:<26} {json.dumps(entry['params'], sort_keys=True):<60} "
+              f"{before['mean_ms']:>10.3f} -> {entry['mean_ms']:>10.3f} ms ({change:+.1f}%)")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark recognition and reporting hot paths')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='user counts and history sizes to generate')
+    parser.add_argument('--faces', type=int, nargs='+', default=[1, 10, 40], help='faces per group image')
+    parser.add_argument('--widths', type=int, nargs='+', default=[1280, 4000], help='group image widths in pixels')
+    parser.add_argument('--repeat', type=int, default=20, help='timed runs per measurement')
+    parser.add_argument('--stub-latency-ms', type=float, default=0.0, help='fixed cost per stub model call')
+    parser.add_argument('--stub-per-image-ms', type=float, default=0.0, help='extra stub cost per image')
+    parser.add_argument('--only', nargs='+', choices=['recognize', 'group', 'match', 'record', 'reports'],
+                        help='run only these benchmarks')
+    parser.add_argument('--output', help='write JSON results to this file (default: stdout)')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two result files and exit')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    # Keep the benchmarks deterministic: no background worker, no upload copies
+    os.environ['FAS_MICROBATCH'] = '0'
+    os.environ['FAS_SAVE_UPLOADS'] = '0'
+    import model_registry
+    model_registry.set_model(StubModel(args.stub_latency_ms, args.stub_per_image_ms))
+
+    selected = set(args.only or ['recognize', 'group', 'match', 'record', 'reports'])
+    results = []
+    with tempfile.TemporaryDirectory(prefix='fas_bench_') as workdir:
+        if 'recognize' in selected:
+            bench_recognize_individual(results, args.repeat, workdir)
+        if 'group' in selected:
+            bench_group_recognition(results, args.repeat, args.faces, args.widths)
+        if 'match' in selected:
+            bench_matching(results, args.repeat, args.sizes, workdir)
+        if 'record' in selected:
+            bench_record_attendance(results, args.repeat, args.sizes, workdir)
+        if 'reports' in selected:
+            bench_reports(results, args.repeat, args.sizes, workdir)
+
+    report = {
+        'commit': git_commit(),
+        'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'results': results
+    }
+    if args.output:
+        write_json(args.output, report)
+        print(f"Wrote {len(results)} results to {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
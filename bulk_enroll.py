@@ -0,0 +1,194 @@
+"""
+Bulk enrollment of users from a directory of photos or a CSV file
+
+    python bulk_enroll.py photos/                 # photos/<username>.jpg
+    python bulk_enroll.py students.csv            # columns: username,email,photo
+
+Images are decoded and face-cropped on a process pool, embedded in batches,
+and enrolled into the gallery batch by batch. Progress is kept in a checkpoint
+file so an interrupted run can be resumed by running the same command again.
+All new users are written to users.json in one write at the end, and images
+that could not be enrolled are listed in an error report.
+
+It is safe to run while the server is up: gallery appends and users.json
+writes are serialized with the server's through lock files, and the server
+picks up the new gallery rows on its next recognition. Enrolled faces are
+recognized from then on, though the users only appear in users.json (and so
+in reports) once the run finishes.
+
+Gallery rows are tagged with the photo they came from, so a run that stopped
+between an enrollment and its checkpoint line does not enroll that photo twice.
+"""
+import argparse
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import cv2
+from PIL import Image
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+def read_entries(source):
+    """Return {username, email, photo} entries from a photo directory or a CSV file"""
+    if os.path.isdir(source):
+        entries = []
+        for name in sorted(os.listdir(source)):
+            stem, extension = os.path.splitext(name)
+            if extension.lower() in IMAGE_EXTENSIONS:
+                entries.append({'username': stem, 'email': '', 'photo': os.path.join(source, name)})
+        return entries
+
+    base_dir = os.path.dirname(os.path.abspath(source))
+    entries = []
+    with open(source, newline='') as f:
+        for row in csv.DictReader(f):
+            photo = row.get('photo', '').strip()
+            if photo and not os.path.isabs(photo):
+                photo = os.path.join(base_dir, photo)
+            entries.append({
+                'username': row.get('username', '').strip(),
+                'email': row.get('email', '').strip(),
+                'photo': photo
+            })
+    return entries
+
+def entry_key(entry):
+    return f"{entry['username']}|{entry['photo']}"
+
+def crop_face(entry):
+    """
+    Worker-process step: decode one photo and crop its largest face
+    Returns (entry, RGB crop array, None) or (entry, None, error message)
+    """
+    from face_detector import get_detector
+    from face_quality import filter_faces
+
+    if not entry['username']:
+        return entry, None, "Missing username"
+    image = cv2.imread(entry['photo'])
+    if image is None:
+        return entry, None, "Could not load image"
+    try:
+        faces = get_detector().detect(image)
+    except Exception as e:
+        return entry, None, str(e)
+    if not faces:
+        return entry, None, "No face detected"
+    usable, skipped = filter_faces(image, faces)
+    if not usable:
+        return entry, None, f"No usable face ({', '.join(sorted(skipped))})"
+
+    x, y, w, h = max(usable, key=lambda face: face[2] * face[3])
+    return entry, cv2.cvtColor(image[y:y+h, x:x+w], cv2.COLOR_BGR2RGB), None
+
+def load_checkpoint(path):
+    done = {}
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    record = json.loads(line)
+                    done[record['key']] = record
+    return done
+
+def checkpoint_enrolled(entries, checkpoint):
+    registered_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    for entry in entries:
+        user = {
+            'username': entry['username'],
+            'email': entry['email'],
+            'photo_path': os.path.abspath(entry['photo']),
+            'registered_at': registered_at
+        }
+        checkpoint.write(json.dumps({'key': entry_key(entry), 'status': 'enrolled', 'user': user}) + '\n')
+    checkpoint.flush()
+
+def enroll_batch(batch, gallery, checkpoint):
+    """Embed a batch of crops, enroll them in one gallery append and checkpoint the results"""
+    from attendance import embed_images
+
+    embeddings = embed_images([Image.fromarray(crop) for _, crop in batch], batch_size=len(batch))
+    # Rows are tagged with their checkpoint key, so a crash before the checkpoint
+    # write below does not enroll the batch a second time on resume
+    gallery.enroll_many([entry['username'] for entry, _ in batch], embeddings,
+                        sources=[entry_key(entry) for entry, _ in batch])
+    checkpoint_enrolled([entry for entry, _ in batch], checkpoint)
+
+def bulk_enroll(source, checkpoint_path, errors_path, workers=None, batch_size=32):
+    from gallery import get_gallery
+    from user_directory import get_user_directory
+
+    entries = read_entries(source)
+    done = load_checkpoint(checkpoint_path)
+    pending = [entry for entry in entries if entry_key(entry) not in done]
+
+    gallery = get_gallery()
+    # Entries enrolled by an earlier run that stopped before checkpointing them
+    enrolled = gallery.enrolled_sources()
+    recovered = [entry for entry in pending if entry_key(entry) in enrolled]
+    pending = [entry for entry in pending if entry_key(entry) not in enrolled]
+    print(f"{len(entries)} entries, {len(entries) - len(pending)} already processed, {len(pending)} to go")
+
+    started = time.perf_counter()
+    processed = 0
+    batch = []
+    with open(checkpoint_path, 'a') as checkpoint, ProcessPoolExecutor(max_workers=workers) as pool:
+        checkpoint_enrolled(recovered, checkpoint)
+        for entry, crop, error in pool.map(crop_face, pending, chunksize=8):
+            processed += 1
+            if error:
+                checkpoint.write(json.dumps({'key': entry_key(entry), 'status': 'error', 'error': error,
+                                             'username': entry['username'], 'photo': entry['photo']}) + '\n')
+            else:
+                batch.append((entry, crop))
+                if len(batch) >= batch_size:
+                    enroll_batch(batch, gallery, checkpoint)
+                    batch = []
+
+            if processed % batch_size == 0 or processed == len(pending):
+                elapsed = time.perf_counter() - started
+                rate = processed / elapsed if elapsed else 0.0
+                print(f"  {processed}/{len(pending)} images, {rate:.1f} images/s")
+
+        if batch:
+            enroll_batch(batch, gallery, checkpoint)
+
+    elapsed = time.perf_counter() - started
+    done = load_checkpoint(checkpoint_path)
+
+    # Commit every enrolled user not yet in users.json with a single write
+    directory = get_user_directory()
+    existing = {(user['username'], user.get('photo_path')) for user in directory.all_users()}
+    new_users = [record['user'] for record in done.values()
+                 if record['status'] == 'enrolled'
+                 and (record['user']['username'], record['user']['photo_path']) not in existing]
+    if new_users:
+        directory.add_users(new_users)
+
+    errors = [record for record in done.values() if record['status'] == 'error']
+    with open(errors_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['username', 'photo', 'error'])
+        for record in errors:
+            writer.writerow([record['username'], record['photo'], record['error']])
+
+    rate = processed / elapsed if elapsed else 0.0
+    print(f"Enrolled {len(new_users)} new users, {len(errors)} errors (see {errors_path})")
+    print(f"Processed {processed} images in {elapsed:.1f}s ({rate:.1f} images/s)")
+    return {'processed': processed, 'enrolled': len(new_users), 'errors': len(errors),
+            'seconds': round(elapsed, 3), 'images_per_second': round(rate, 2)}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Enroll many users at once from photos')
+    parser.add_argument('source', help='directory of <username>.jpg photos, or a CSV with username,email,photo')
+    parser.add_argument('--checkpoint', default='bulk_enroll.checkpoint.jsonl', help='progress file used to resume')
+    parser.add_argument('--errors', default='bulk_enroll_errors.csv', help='where to write the per-image error report')
+    parser.add_argument('--workers', type=int, default=None, help='decode/crop processes (default: CPU count)')
+    parser.add_argument('--batch-size', type=int, default=32, help='faces per embedding batch')
+    args = parser.parse_args()
+
+    bulk_enroll(args.source, args.checkpoint, args.errors, workers=args.workers, batch_size=args.batch_size)
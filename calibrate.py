@@ -0,0 +1,97 @@
+"""
+Measure match scores on labelled photos to choose the gallery's thresholds
+
+    python calibrate.py
+    python calibrate.py photos/*.jpg
+
+Photos are named <username>_<timestamp>.jpg, as registrations in uploads/
+are. The largest face of each photo is embedded with the configured model,
+and every pair is scored: pairs of the same user give the same-person
+distribution, the rest the different-person one. For each photo with
+another photo of its user, the gap between its best same-person and best
+different-person score is what FAS_MATCH_MIN_MARGIN has to stay under.
+The suggested FAS_MATCH_THRESHOLD and FAS_MATCH_MIN_MARGIN are printed
+with the distributions.
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import numpy as np
+
+_base_dir = os.path.dirname(os.path.abspath(__file__))
+
+def username_for(path):
+    """The username in a <username>_<timestamp>.jpg file name, or None"""
+    match = re.match(r'^(.+)_\d+$', os.path.splitext(os.path.basename(path))[0])
+    return match.group(1) if match else None
+
+def _summary(scores):
+    if not len(scores):
+        return None
+    scores = np.asarray(scores)
+    return {
+        'count': int(len(scores)),
+        'min': round(float(scores.min()), 4),
+        'p05': round(float(np.percentile(scores, 5)), 4),
+        'mean': round(float(scores.mean()), 4),
+        'p95': round(float(np.percentile(scores, 95)), 4),
+        'max': round(float(scores.max()), 4)
+    }
+
+def calibrate(image_paths):
+    from attendance import embed_faces
+    from gallery import _normalize
+
+    labels = []
+    vectors = []
+    for path in image_paths:
+        username = username_for(path)
+        if username is None:
+            continue
+        embeddings, positions = embed_faces(path)
+        if not positions:
+            continue
+        largest = max(range(len(positions)), key=lambda i: positions[i]['width'] * positions[i]['height'])
+        labels.append(username)
+        vectors.append(embeddings[largest])
+    if len(vectors) < 2:
+        raise ValueError("Need at least two labelled photos with a detectable face")
+
+    scores = _normalize(np.stack(vectors)) @ _normalize(np.stack(vectors)).T
+    labels = np.array(labels)
+    same_user = labels[:, None] == labels[None, :]
+    upper = np.triu(np.ones_like(same_user), k=1)
+    same = scores[same_user & upper]
+    different = scores[~same_user & upper]
+
+    gaps = []
+    for i in range(len(labels)):
+        others = same_user[i].copy()
+        others[i] = False
+        if others.any() and (~same_user[i]).any():
+            gaps.append(scores[i, others].max() - scores[i, ~same_user[i]].max())
+
+    report = {
+        'photos': len(labels),
+        'users': len(set(labels)),
+        'same_person': _summary(same),
+        'different_person': _summary(different),
+        'best_same_minus_best_different': _summary(gaps)
+    }
+    if len(same) and len(different):
+        # Halfway between the closest different-person pair and the furthest same-person pair
+        report['separable'] = bool(different.max() < same.min())
+        report['suggested_threshold'] = round(float(different.max() + same.min()) / 2, 4)
+    positive = [gap for gap in gaps if gap > 0]
+    if positive:
+        report['suggested_min_margin'] = round(float(min(positive)) / 2, 4)
+    return report
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure same- and different-person match scores')
+    parser.add_argument('photos', nargs='*', help='labelled photos (default: uploads/*.jpg)')
+    args = parser.parse_args()
+    photos = args.photos or sorted(glob.glob(os.path.join(_base_dir, 'uploads', '*.jpg')))
+    print(json.dumps(calibrate(photos), indent=2))
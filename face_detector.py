@@ -0,0 +1,298 @@
+import glob
+import os
+import queue
+import threading
+import time
+import cv2
+import numpy as np
+
+_base_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Which detector to use, and a soft cap on the longest side of the detection copy of an image:
+# the copy is only shrunk to DETECT_MAX_SIDE as far as DETECT_MIN_FACE allows
+DETECTOR_BACKEND = os.environ.get('FAS_DETECTOR', 'haar')
+DETECT_MAX_SIDE = int(os.environ.get('FAS_DETECT_MAX_SIDE', 640))
+# Smallest face, in original-image pixels, that must survive the downscale: an image is shrunk
+# at most DETECT_MIN_FACE / 24 times (the Haar window), i.e. 2x by default, which still lets a
+# large upload be decoded at 1/2 scale; 96 allows the 1/4 decode and a 4x smaller copy
+DETECT_MIN_FACE = int(os.environ.get('FAS_DETECT_MIN_FACE', 48))
+# Detector instances per process, i.e. how many images can be scanned for faces at once
+DETECTOR_INSTANCES = int(os.environ.get('FAS_DETECTOR_INSTANCES', 4))
+
+# OpenCV DNN (res10 SSD) model files; download them from the OpenCV face_detector samples
+DNN_PROTOTXT = os.environ.get('FAS_DNN_PROTOTXT', os.path.join(_base_dir, 'models', 'deploy.prototxt'))
+DNN_WEIGHTS = os.environ.get('FAS_DNN_WEIGHTS', os.path.join(_base_dir, 'models', 'res10_300x300_ssd_iter_140000.caffemodel'))
+
+class FaceDetector:
+    """
+    Base class for face detectors
+    detect() runs on a downscaled copy of the image and returns boxes as
+    (x, y, w, h) tuples in the coordinates of the full-resolution image
+    """
+
+    name = 'base'
+    # Smallest face, in pixels of the copy handed to _detect, the detector can find
+    min_window = 24
+
+    def __init__(self, max_side=DETECT_MAX_SIDE, instances=DETECTOR_INSTANCES, min_face=DETECT_MIN_FACE):
+        self.max_side = max_side
+        self.min_face = min_face
+        # OpenCV detectors keep internal buffers, so each call borrows an instance
+        # from a small pool; more are loaded on demand, up to `instances`
+        self.instances = max(1, instances)
+        self._pool = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 1
+        self._pool.put(self._load())
+
+    def _acquire(self):
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            create = self._created < self.instances
+            if create:
+                self._created += 1
+        if not create:
+            return self._pool.get()
+        try:
+            return self._load()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def max_reduction(self):
+        """How far an image may be shrunk before it reaches detect() without losing min_face faces"""
+        if not (self.min_face and self.min_window):
+            return float('inf')
+        return self.min_face / self.min_window
+
+    def detect(self, image, image_scale=1):
+        """
+        Find faces in a BGR image
+        image_scale is how many original pixels one pixel of image stands for,
+        when it was already decoded at reduced resolution; min_face is measured
+        in original pixels.
+        """
+        height, width = image.shape[:2]
+        scale = 1.0
+        if self.max_side and max(height, width) > self.max_side:
+            scale = self.max_side / max(height, width)
+            # Never shrink a min_face face below what the detector can see
+            scale = min(1.0, max(scale, image_scale / self.max_reduction()))
+        if scale < 1:
+            small = cv2.resize(image, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+        else:
+            small = image
+
+        engine = self._acquire()
+        try:
+            boxes = self._detect(engine, small)
+        finally:
+            self._pool.put(engine)
+
+        faces = []
+        for (x, y, w, h) in boxes:
+            # Map back to full resolution and clip to the image
+            x0 = max(0, int(round(x / scale)))
+            y0 = max(0, int(round(y / scale)))
+            x1 = min(width, int(round((x + w) / scale)))
+            y1 = min(height, int(round((y + h) / scale)))
+            if x1 > x0 and y1 > y0:
+                faces.append((x0, y0, x1 - x0, y1 - y0))
+        return faces
+
+    def _load(self):
+        raise NotImplementedError
+
+    def _detect(self, engine, image):
+        raise NotImplementedError
+
+class HaarCascadeDetector(FaceDetector):
+    name = 'haar'
+
+    def __init__(self, max_side=DETECT_MAX_SIDE, scale_factor=1.1, min_neighbors=4, min_size=(24, 24),
+                 instances=DETECTOR_INSTANCES, min_face=DETECT_MIN_FACE):
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.min_size = min_size
+        self.min_window = min(min_size)
+
+        # Load OpenCV's pre-trained face detector
+        cascade_path = os.path.join(cv2.data.haarcascades, 'haarcascade_frontalface_default.xml')
+        if not os.path.exists(cascade_path):
+            # Fallback to the copy shipped with the app
+            cascade_path = os.path.join(_base_dir, 'haarcascade_frontalface_default.xml')
+            if not os.path.exists(cascade_path):
+                raise FileNotFoundError("Face cascade file not found")
+        self.cascade_path = cascade_path
+        super().__init__(max_side, instances, min_face)
+
+    def _load(self):
+        return cv2.CascadeClassifier(self.cascade_path)
+
+    def _detect(self, cascade, image):
+        gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        return cascade.detectMultiScale(gray, self.scale_factor, self.min_neighbors, minSize=self.min_size)
+
+class DnnFaceDetector(FaceDetector):
+    name = 'dnn'
+    # The network sees a fixed-size resize of the whole copy, so shrinking it first loses nothing more
+    min_window = 0
+
+    def __init__(self, max_side=DETECT_MAX_SIDE, confidence=0.5, input_size=(300, 300),
+                 prototxt=DNN_PROTOTXT, weights=DNN_WEIGHTS, instances=DETECTOR_INSTANCES,
+                 min_face=DETECT_MIN_FACE):
+        self.confidence = confidence
+        self.input_size = input_size
+        if not (os.path.exists(prototxt) and os.path.exists(weights)):
+            raise FileNotFoundError("DNN face detector model files not found")
+        self.prototxt = prototxt
+        self.weights = weights
+        super().__init__(max_side, instances, min_face)
+
+    def _load(self):
+        return cv2.dnn.readNetFromCaffe(self.prototxt, self.weights)
+
+    def _detect(self, net, image):
+        if image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        height, width = image.shape[:2]
+        blob = cv2.dnn.blobFromImage(cv2.resize(image, self.input_size), 1.0, self.input_size, (104.0, 177.0, 123.0))
+        net.setInput(blob)
+        detections = net.forward()[0, 0]
+
+        boxes = []
+        for detection in detections:
+            if detection[2] < self.confidence:
+                continue
+            x0, y0, x1, y1 = detection[3:7] * np.array([width, height, width, height])
+            boxes.append((x0, y0, x1 - x0, y1 - y0))
+        return boxes
+
+DETECTOR_BACKENDS = {
+    HaarCascadeDetector.name: HaarCascadeDetector,
+    DnnFaceDetector.name: DnnFaceDetector
+}
+
+_detector = None
+_detector_lock = threading.Lock()
+
+def create_detector(backend=DETECTOR_BACKEND, **params):
+    if backend not in DETECTOR_BACKENDS:
+        raise ValueError(f"Unknown face detector backend: {backend}")
+    return DETECTOR_BACKENDS[backend](**params)
+
+def get_detector():
+    """Return the process-wide face detector, loading it on first use"""
+    global _detector
+    if _detector is None:
+        with _detector_lock:
+            if _detector is None:
+                _detector = create_detector()
+    return _detector
+
+def iou(a, b):
+    """Intersection over union of two (x, y, w, h) boxes"""
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    iw = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    ih = max(0, min(ay + ah, by + bh) - max(ay, by))
+    intersection = iw * ih
+    union = aw * ah + bw * bh - intersection
+    return intersection / union if union else 0.0
+
+def make_group_image(image_paths, size=(4000, 3000), face_side=60):
+    """
+    Tile the faces found in image_paths into one large synthetic group photo
+    Each face is scaled down to about face_side pixels, like a 12 MP photo of a
+    class or a crowd, which is what a downscale that only suits small uploads misses.
+    """
+    detector = create_detector('haar', max_side=0)
+    crops = []
+    for path in image_paths:
+        image = cv2.imread(path)
+        if image is None:
+            continue
+        for (x, y, w, h) in detector.detect(image):
+            if w < 2 * face_side:
+                # Upscaled faces are blurrier than any real photo; only sharp sources are used
+                continue
+            # Keep half a face of context on each side, as in a real photo
+            padded = cv2.copyMakeBorder(image, h // 2, h // 2, w // 2, w // 2, cv2.BORDER_REPLICATE)
+            crops.append(padded[y:y + 2 * h, x:x + 2 * w])
+
+    width, height = size
+    canvas = np.full((height, width, 3), 128, dtype=np.uint8)
+    cell = 2 * face_side
+    if not crops:
+        return canvas
+    index = 0
+    for top in range(0, height - cell + 1, cell):
+        for left in range(0, width - cell + 1, cell):
+            canvas[top:top + cell, left:left + cell] = cv2.resize(crops[index % len(crops)], (cell, cell),
+                                                                  interpolation=cv2.INTER_AREA)
+            index += 1
+    return canvas
+
+def compare_backends(images, configs):
+    """
+    Time each detector configuration over a set of images
+    images holds file paths or (name, BGR image) pairs. Recall is measured
+    against the first configuration's boxes (IoU >= 0.5), since the sample
+    images have no ground-truth labels
+    """
+    images = [item if isinstance(item, tuple) else (item, cv2.imread(item)) for item in images]
+    images = [(path, image) for path, image in images if image is not None]
+
+    reference = None
+    report = []
+    for label, backend, params in configs:
+        try:
+            detector = create_detector(backend, **params)
+        except (FileNotFoundError, ValueError) as e:
+            report.append({'config': label, 'error': str(e)})
+            continue
+
+        boxes = {}
+        elapsed = 0.0
+        for path, image in images:
+            start = time.perf_counter()
+            boxes[path] = detector.detect(image)
+            elapsed += time.perf_counter() - start
+
+        row = {
+            'config': label,
+            'images': len(images),
+            'faces': sum(len(found) for found in boxes.values()),
+            'mean_ms': round(elapsed * 1000 / len(images), 2) if images else 0.0
+        }
+        if reference is None:
+            reference = boxes
+        else:
+            expected = sum(len(found) for found in reference.values())
+            matched = sum(
+                1 for path, found in reference.items() for box in found
+                if any(iou(box, other) >= 0.5 for other in boxes[path])
+            )
+            row['recall_vs_reference'] = round(matched / expected, 3) if expected else None
+        report.append(row)
+    return report
+
+if __name__ == '__main__':
+    # Compare detector backends on the sample images in uploads/, which are all small,
+    # and on a 4000x3000 group photo tiled from their faces at about 60 pixels each
+    image_paths = sorted(glob.glob(os.path.join(_base_dir, 'uploads', '*.jpg')))
+    configs = [
+        ('haar full-res', 'haar', {'max_side': 0}),
+        ('haar 640', 'haar', {'max_side': 640}),
+        ('haar 640 no min face', 'haar', {'max_side': 640, 'min_face': 0}),
+        ('haar 480', 'haar', {'max_side': 480}),
+        ('dnn 640', 'dnn', {'max_side': 640})
+    ]
+    for name, images in [('uploads', image_paths),
+                         ('group 4000x3000', [('group', make_group_image(image_paths))])]:
+        for row in compare_backends(images, configs):
+            print(name, row)
@@ -0,0 +1,72 @@
+import os
+import cv2
+
+# Thresholds for dropping detections that are not worth a model call
+MIN_FACE_SIZE = int(os.environ.get('FAS_MIN_FACE_SIZE', 40))
+MIN_SHARPNESS = float(os.environ.get('FAS_MIN_SHARPNESS', 30.0))
+MIN_ASPECT_RATIO = float(os.environ.get('FAS_MIN_ASPECT_RATIO', 0.6))
+MAX_ASPECT_RATIO = float(os.environ.get('FAS_MAX_ASPECT_RATIO', 1.6))
+# Exposure only rules out crops that are nearly black or white: a dim but sharp face
+# (mean ~35, as in some webcam registrations) still embeds well, and blur is checked separately
+MIN_BRIGHTNESS = float(os.environ.get('FAS_MIN_BRIGHTNESS', 15.0))
+MAX_BRIGHTNESS = float(os.environ.get('FAS_MAX_BRIGHTNESS', 240.0))
+MAX_OVERLAP = float(os.environ.get('FAS_MAX_FACE_OVERLAP', 0.5))
+QUALITY_GATE_ENABLED = os.environ.get('FAS_QUALITY_GATE', '1') == '1'
+
+def _containment(a, b):
+    """Intersection over the smaller box, so a box nested inside another counts as a duplicate"""
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    iw = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    ih = max(0, min(ay + ah, by + bh) - max(ay, by))
+    smaller = min(aw * ah, bw * bh)
+    return iw * ih / smaller if smaller else 0.0
+
+def filter_faces(image, faces, scale=1):
+    """
+    Drop detections that are too small, blurred, oddly shaped, nearly black or
+    white, or that duplicate a larger detection
+    image is the BGR image the boxes refer to; scale converts its pixels to the
+    original resolution, which the size threshold is expressed in.
+    Returns (kept boxes, {reason: count of skipped boxes})
+    """
+    skipped = {}
+    if not QUALITY_GATE_ENABLED:
+        return list(faces), skipped
+
+    def skip(reason):
+        skipped[reason] = skipped.get(reason, 0) + 1
+
+    candidates = []
+    for box in faces:
+        x, y, w, h = box
+        if min(w, h) * scale < MIN_FACE_SIZE:
+            skip('too_small')
+            continue
+        if not MIN_ASPECT_RATIO <= w / h <= MAX_ASPECT_RATIO:
+            skip('aspect_ratio')
+            continue
+
+        crop = image[y:y+h, x:x+w]
+        gray = crop if crop.ndim == 2 else cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+        brightness = float(gray.mean())
+        if brightness < MIN_BRIGHTNESS:
+            skip('too_dark')
+            continue
+        if brightness > MAX_BRIGHTNESS:
+            skip('too_bright')
+            continue
+        # Variance of the Laplacian: low values mean few edges, i.e. a blurred crop
+        if cv2.Laplacian(gray, cv2.CV_64F).var() < MIN_SHARPNESS:
+            skip('blurred')
+            continue
+        candidates.append(box)
+
+    # Overlap suppression: keep the larger of any two boxes covering the same face
+    kept = []
+    for box in sorted(candidates, key=lambda b: b[2] * b[3], reverse=True):
+        if any(_containment(box, other) > MAX_OVERLAP for other in kept):
+            skip('duplicate')
+            continue
+        kept.append(box)
+    return [box for box in candidates if box in kept], skipped
@@ -0,0 +1,405 @@
+import json
+import os
+import threading
+import numpy as np
+from file_lock import file_lock
+
+# Cosine similarity a face must reach to count as a match, and how many candidates to return;
+# measure the model's same- and different-person scores with calibrate.py before relying on it
+MATCH_THRESHOLD = float(os.environ.get('FAS_MATCH_THRESHOLD', 0.85))
+MATCH_TOP_K = int(os.environ.get('FAS_MATCH_TOP_K', 3))
+# A face only matches when its best user beats the next-best user by at least this much;
+# ResNet features are non-negative, so unrelated faces also score high and only the gap
+# between the top two tells a confident match from a coin toss (see calibrate.py)
+MATCH_MIN_MARGIN = float(os.environ.get('FAS_MATCH_MIN_MARGIN', 0.05))
+# Large galleries are first scanned with embeddings reduced by PCA to MATCH_REDUCED_DIM
+# dimensions; the best MATCH_SHORTLIST rows per face are then re-scored exactly
+MATCH_REDUCE_MIN_ROWS = int(os.environ.get('FAS_MATCH_REDUCE_MIN_ROWS', 4096))
+MATCH_REDUCED_DIM = int(os.environ.get('FAS_MATCH_REDUCED_DIM', 64))
+MATCH_SHORTLIST = int(os.environ.get('FAS_MATCH_SHORTLIST', 64))
+PCA_SAMPLE_ROWS = 4096
+
+_base_dir = os.path.dirname(os.path.abspath(__file__))
+GALLERY_DIR = os.path.join(_base_dir, 'data', 'gallery')
+
+class FaceGallery:
+    """
+    In-memory index of enrolled face embeddings backed by two append-only files:
+    embeddings.f32 holds the raw float32 rows, rows.jsonl records which user owns
+    each row (by row number) and which rows have been removed. Enrolling or
+    removing a face only appends to these files, so the index is never rebuilt
+    for a single change.
+    Several processes may share one gallery directory: appends are serialized
+    with a lock file, and each process picks up the others' appends the next
+    time it touches the gallery, by reading only what was added to the files.
+    """
+
+    def __init__(self, directory=GALLERY_DIR):
+        self.directory = directory
+        self.embeddings_path = os.path.join(directory, 'embeddings.f32')
+        self.rows_path = os.path.join(directory, 'rows.jsonl')
+        self.lock_path = os.path.join(directory, '.lock')
+        self.dim = None
+        self._version = 0
+        self._lock = threading.RLock()
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._size = 0
+        self._usernames = []
+        self._active = np.zeros(0, dtype=bool)
+        # How much of rows.jsonl has been read, labels for rows not loaded yet, and removed rows
+        self._rows_offset = 0
+        self._pending = {}
+        self._removed = set()
+        self._signature = None
+        # PCA basis for the coarse scan, the reduced rows, and the gallery size it was fitted at
+        self._components = None
+        self._reduced = np.zeros((0, 0), dtype=np.float32)
+        self._reduced_size = 0
+        self._fitted_size = 0
+        self._fitting = False
+        with self._lock:
+            self._refresh()
+
+    @property
+    def version(self):
+        """Bumped on every change, including appends made by other processes"""
+        with self._lock:
+            self._refresh()
+            return self._version
+
+    def _file_signature(self):
+        signature = []
+        for path in (self.embeddings_path, self.rows_path):
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def _refresh(self):
+        """Load whatever was appended to the files since the last call; needs self._lock"""
+        signature = self._file_signature()
+        if signature == self._signature:
+            return
+        self._signature = signature
+
+        # Labels are read before embeddings: writers append the embedding first,
+        # so every label seen here has its row on disk by the time it is read below
+        entries = []
+        if signature[1] is not None:
+            with open(self.rows_path, 'rb') as f:
+                f.seek(self._rows_offset)
+                data = f.read()
+            # Leave a partially written last line for the next refresh
+            complete = data.rfind(b'\n') + 1
+            self._rows_offset += complete
+            for line in data[:complete].splitlines():
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    continue
+
+        for entry in entries:
+            op = entry.get('op')
+            if op == 'meta':
+                self.dim = self.dim or entry['dim']
+            elif op == 'remove':
+                self._removed.add(entry['row'])
+                self._pending.pop(entry['row'], None)
+                if entry['row'] < self._size:
+                    self._active[entry['row']] = False
+            elif entry['row'] not in self._removed:
+                self._pending[entry['row']] = entry['username']
+
+        if self.dim is not None and signature[0] is not None:
+            # Ignore a partially written trailing row
+            file_rows = signature[0][1] // (4 * self.dim)
+            if file_rows > self._size:
+                new = np.fromfile(self.embeddings_path, dtype=np.float32,
+                                  count=(file_rows - self._size) * self.dim,
+                                  offset=self._size * self.dim * 4).reshape(-1, self.dim)
+                self._ensure_capacity(len(new))
+                self._matrix[self._size:self._size + len(new)] = new
+                # Rows stay inactive until their label is seen
+                self._active[self._size:self._size + len(new)] = False
+                self._usernames.extend([None] * len(new))
+                self._size += len(new)
+
+        for row in [row for row in self._pending if row < self._size]:
+            self._usernames[row] = self._pending.pop(row)
+            self._active[row] = True
+        self._version += 1
+
+    def _append(self, embeddings=None, entries=()):
+        """Append rows and labels to the files; needs self._lock and the file lock"""
+        if embeddings is not None:
+            # Cut a row left half-written by an interrupted append, so ours start on a row boundary
+            size = os.path.getsize(self.embeddings_path) if os.path.exists(self.embeddings_path) else 0
+            if size % (4 * self.dim):
+                os.truncate(self.embeddings_path, size - size % (4 * self.dim))
+            with open(self.embeddings_path, 'ab') as f:
+                f.write(embeddings.tobytes())
+        with open(self.rows_path, 'ab') as f:
+            prefix = b''
+            if f.tell() and self._rows_offset < f.tell():
+                # An interrupted label write left a line without its newline
+                prefix = b'\n'
+            f.write(prefix + ''.join(json.dumps(entry) + '\n' for entry in entries).encode())
+            self._rows_offset = f.tell()
+        self._signature = self._file_signature()
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return int(self._active[:self._size].sum())
+
+    def _ensure_capacity(self, extra):
+        needed = self._size + extra
+        if needed <= len(self._matrix):
+            return
+        capacity = max(needed, 2 * len(self._matrix), 64)
+        matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+        if self._size:
+            matrix[:self._size] = self._matrix[:self._size]
+        active = np.zeros(capacity, dtype=bool)
+        active[:self._size] = self._active[:self._size]
+        self._matrix = matrix
+        self._active = active
+
+    def enroll(self, username, embeddings):
+        """Add one or more embeddings for a user; returns the new row numbers"""
+        embeddings = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        return self.enroll_many([username] * len(embeddings), embeddings)
+
+    def enroll_many(self, usernames, embeddings, sources=None):
+        """
+        Add one embedding row per username with a single append to each file
+        sources optionally tags each row with where it came from, such as the
+        photo a bulk enrollment read it from; see enrolled_sources()
+        """
+        embeddings = _normalize(np.atleast_2d(np.asarray(embeddings, dtype=np.float32)))
+        if len(usernames) != len(embeddings):
+            raise ValueError("Expected one username per embedding")
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock, file_lock(self.lock_path):
+            # Catch up with other processes first, so row numbers match file positions
+            self._refresh()
+            if self.dim is None:
+                self.dim = embeddings.shape[1]
+                self._append(entries=[{'op': 'meta', 'dim': self.dim}])
+            elif embeddings.shape[1] != self.dim:
+                raise ValueError(f"Embedding size {embeddings.shape[1]} does not match gallery size {self.dim}")
+
+            first_row = self._size
+            rows = list(range(first_row, first_row + len(embeddings)))
+            entries = [{'op': 'add', 'row': row, 'username': username} for row, username in zip(rows, usernames)]
+            for entry, source in zip(entries, sources or []):
+                entry['source'] = source
+            self._append(embeddings, entries)
+
+            self._ensure_capacity(len(embeddings))
+            self._matrix[first_row:first_row + len(embeddings)] = embeddings
+            self._active[first_row:first_row + len(embeddings)] = True
+            self._usernames.extend(usernames)
+            self._size += len(embeddings)
+            self._version += 1
+            return rows
+
+    def enrolled_sources(self):
+        """The sources tagged on rows that are still enrolled, read from the labels file"""
+        if not os.path.exists(self.rows_path):
+            return set()
+        sources = {}
+        removed = set()
+        with open(self.rows_path, 'rb') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A label still being written by another process
+                    continue
+                if entry.get('op') == 'remove':
+                    removed.add(entry['row'])
+                elif 'source' in entry:
+                    sources[entry['row']] = entry['source']
+        return {source for row, source in sources.items() if row not in removed}
+
+    def remove(self, username):
+        """Remove every embedding enrolled for a user; returns how many rows were dropped"""
+        if not os.path.isdir(self.directory):
+            return 0
+        with self._lock, file_lock(self.lock_path):
+            self._refresh()
+            rows = [row for row, name in enumerate(self._usernames)
+                    if name == username and self._active[row]]
+            if not rows:
+                return 0
+            self._append(entries=[{'op': 'remove', 'row': row} for row in rows])
+            self._active[rows] = False
+            self._removed.update(rows)
+            self._version += 1
+            return len(rows)
+
+    def _maybe_refit(self, background=True):
+        """Fit the PCA basis once the gallery is large, and again each time it doubles; needs self._lock"""
+        if (self._fitting or self._size < MATCH_REDUCE_MIN_ROWS or self.dim <= MATCH_REDUCED_DIM
+                or self._size < 2 * self._fitted_size):
+            return
+        self._fitting = True
+        if background:
+            threading.Thread(target=self._fit, args=(self._matrix, self._size),
+                             name='gallery-pca', daemon=True).start()
+        else:
+            self._fit(self._matrix, self._size)
+
+    def _fit(self, matrix, size):
+        try:
+            # Uncentered PCA of a sample: the top eigenvectors of X^T X preserve dot products best
+            rng = np.random.default_rng(0)
+            sample = matrix[rng.choice(size, min(size, PCA_SAMPLE_ROWS), replace=False)]
+            _, vectors = np.linalg.eigh(sample.T @ sample)
+            components = np.ascontiguousarray(vectors[:, ::-1][:, :MATCH_REDUCED_DIM], dtype=np.float32)
+            # Rows are never rewritten, so the snapshot can be projected outside the lock
+            reduced = matrix[:size] @ components
+            with self._lock:
+                self._components = components
+                self._reduced = reduced
+                self._reduced_size = size
+                self._fitted_size = size
+        finally:
+            self._fitting = False
+
+    def prepare(self):
+        """Fit the reduced index now rather than in the background (used by the benchmarks)"""
+        with self._lock:
+            self._refresh()
+            self._maybe_refit(background=False)
+
+    def _reduced_rows(self):
+        """Reduced rows covering the whole gallery, projecting rows added since the fit; needs self._lock"""
+        if self._reduced_size < self._size:
+            new = self._matrix[self._reduced_size:self._size] @ self._components
+            if self._size > len(self._reduced):
+                reduced = np.zeros((max(self._size, 2 * len(self._reduced)), self._components.shape[1]),
+                                   dtype=np.float32)
+                reduced[:self._reduced_size] = self._reduced[:self._reduced_size]
+                self._reduced = reduced
+            self._reduced[self._reduced_size:self._size] = new
+            self._reduced_size = self._size
+        return self._reduced[:self._size]
+
+    def match(self, embeddings, threshold=MATCH_THRESHOLD, top_k=MATCH_TOP_K, min_margin=MATCH_MIN_MARGIN):
+        """
+        Match a batch of face embeddings against the gallery
+        Returns, for each face, up to top_k {username, score} candidates above the
+        threshold, best first, with each user appearing at most once. A face whose
+        best user is not min_margin ahead of the next-best user gets none. Small
+        galleries are scored exactly in one matrix product; large ones are
+        scanned in the reduced PCA space and only a shortlist is scored exactly.
+        """
+        embeddings = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        if embeddings.shape[0] == 0:
+            return []
+        queries = _normalize(embeddings)
+        # Over-fetch a little so duplicate rows of the same user do not crowd out others
+        k = top_k * 4
+
+        with self._lock:
+            self._refresh()
+            size = self._size
+            if size == 0 or not self._active[:size].any():
+                return [[] for _ in range(len(embeddings))]
+            active = self._active[:size]
+            usernames = self._usernames[:size]
+            self._maybe_refit()
+
+            if self._components is None:
+                scores = queries @ self._matrix[:size].T
+                scores[:, ~active] = -np.inf
+                k = min(size, k)
+                candidates = np.argpartition(scores, size - k, axis=1)[:, size - k:]
+                candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+            else:
+                coarse = (queries @ self._components) @ self._reduced_rows().T
+                coarse[:, ~active] = -np.inf
+                shortlist = min(size, max(k, MATCH_SHORTLIST))
+                candidates = np.argpartition(coarse, size - shortlist, axis=1)[:, size - shortlist:]
+                candidate_scores = np.matmul(self._matrix[candidates], queries[:, :, None])[:, :, 0]
+                candidate_scores[~active[candidates]] = -np.inf
+
+        matches = []
+        for rows, row_scores in zip(candidates, candidate_scores):
+            order = np.argsort(-row_scores)
+            face_matches = []
+            seen = set()
+            runner_up = None
+            for index in order:
+                score = float(row_scores[index])
+                username = usernames[rows[index]]
+                if username in seen or score == -np.inf:
+                    continue
+                seen.add(username)
+                if len(seen) == 2:
+                    runner_up = score
+                if score < threshold:
+                    # Below the threshold only the runner-up's score is still needed
+                    if runner_up is not None:
+                        break
+                    continue
+                if len(face_matches) < top_k:
+                    face_matches.append({'username': username, 'score': score})
+                elif runner_up is not None:
+                    break
+            if face_matches and runner_up is not None and face_matches[0]['score'] - runner_up < min_margin:
+                # Too close to call between two users
+                face_matches = []
+            matches.append(face_matches)
+        return matches
+
+def _normalize(embeddings):
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return embeddings / norms
+
+_gallery = None
+_gallery_lock = threading.Lock()
+
+def get_gallery():
+    """Return the process-wide gallery, loading it from disk on first use"""
+    global _gallery
+    if _gallery is None:
+        with _gallery_lock:
+            if _gallery is None:
+                _gallery = FaceGallery()
+    return _gallery
+
+if __name__ == '__main__':
+    # Enroll users registered before the gallery existed, using their saved photos
+    from attendance import embed_faces
+    from media_store import media_path
+
+    users_path = os.path.join(_base_dir, 'data', 'users.json')
+    with open(users_path, 'r') as f:
+        users = json.load(f)
+
+    gallery = get_gallery()
+    enrolled = 0
+    for user in users:
+        # Photos may have been saved on another machine, so look them up by name: older
+        # registrations kept the full photo in uploads/, newer ones a face crop in data/media/
+        photo_name = os.path.basename(user.get('photo_path', '').replace('\\', '/'))
+        photo_path = os.path.join(_base_dir, 'uploads', photo_name)
+        if photo_name and not os.path.exists(photo_path):
+            photo_path = media_path(os.path.splitext(photo_name)[0])
+        if not photo_name or not os.path.exists(photo_path):
+            print(f"Skipping {user['username']}: photo not found")
+            continue
+        embeddings, positions = embed_faces(photo_path)
+        if not positions:
+            print(f"Skipping {user['username']}: no usable face in photo")
+            continue
+        largest = max(range(len(positions)), key=lambda i: positions[i]['width'] * positions[i]['height'])
+        gallery.enroll(user['username'], embeddings[largest])
+        enrolled += 1
+    print(f"Enrolled {enrolled} of {len(users)} users ({len(gallery)} gallery entries)")
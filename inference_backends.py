@@ -0,0 +1,212 @@
+"""
+Inference backends for the recognition model
+
+    python inference_backends.py export --output models/resnet50.onnx
+    python inference_backends.py quantize --input models/resnet50.onnx --output models/resnet50.int8.onnx
+    python inference_backends.py validate --backend onnx-int8 --images uploads/
+
+The default 'transformers' backend is the stock PyTorch pipeline. The 'onnx'
+and 'onnx-int8' backends run an exported graph (fp32, or with dynamically
+quantized int8 weights) on ONNX Runtime. Every backend can be called like the
+Transformers image-classification pipeline and provides embed(images).
+"""
+import argparse
+import glob
+import os
+import time
+import numpy as np
+from PIL import Image
+
+# 0 leaves the thread pools at the runtime's default size
+INTRA_OP_THREADS = int(os.environ.get('FAS_INTRA_OP_THREADS', 0))
+INTER_OP_THREADS = int(os.environ.get('FAS_INTER_OP_THREADS', 0))
+
+_base_dir = os.path.dirname(os.path.abspath(__file__))
+ONNX_MODEL_PATH = os.environ.get('FAS_ONNX_MODEL', os.path.join(_base_dir, 'models', 'resnet50.onnx'))
+ONNX_INT8_MODEL_PATH = os.environ.get('FAS_ONNX_INT8_MODEL', os.path.join(_base_dir, 'models', 'resnet50.int8.onnx'))
+
+def _load_image(image):
+    if isinstance(image, str):
+        return Image.open(image).convert('RGB')
+    return image.convert('RGB') if image.mode != 'RGB' else image
+
+class OnnxBackend:
+    """
+    Runs an exported classification graph with outputs (logits, embedding) on ONNX Runtime
+    Preprocessing and labels come from the original model's Transformers config
+    """
+
+    def __init__(self, onnx_path, model_name, intra_op_threads=INTRA_OP_THREADS,
+                 inter_op_threads=INTER_OP_THREADS, top_k=5):
+        import onnxruntime
+        from transformers import AutoConfig, AutoImageProcessor
+
+        if not os.path.exists(onnx_path):
+            raise FileNotFoundError(f"ONNX model not found: {onnx_path} (run 'python inference_backends.py export')")
+
+        options = onnxruntime.SessionOptions()
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        if inter_op_threads:
+            options.inter_op_num_threads = inter_op_threads
+            options.execution_mode = onnxruntime.ExecutionMode.ORT_PARALLEL
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+        self.session = onnxruntime.InferenceSession(onnx_path, options, providers=['CPUExecutionProvider'])
+        self.image_processor = AutoImageProcessor.from_pretrained(model_name)
+        self.id2label = AutoConfig.from_pretrained(model_name).id2label
+        self.top_k = top_k
+
+    def _run(self, images):
+        pixels = self.image_processor(images=[_load_image(image) for image in images], return_tensors='np')
+        logits, embeddings = self.session.run(None, {'pixel_values': pixels['pixel_values'].astype(np.float32)})
+        return logits, embeddings
+
+    def embed(self, images):
+        return self._run(images)[1]
+
+    def __call__(self, inputs, batch_size=None):
+        items = inputs if isinstance(inputs, list) else [inputs]
+        logits, _ = self._run(items)
+        # Softmax over classes, as the Transformers pipeline reports
+        logits = logits - logits.max(axis=1, keepdims=True)
+        probabilities = np.exp(logits)
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+
+        results = []
+        for row in probabilities:
+            top = np.argsort(-row)[:self.top_k]
+            results.append([{'label': self.id2label[int(i)], 'score': float(row[i])} for i in top])
+        return results if isinstance(inputs, list) else results[0]
+
+def configure_torch_threads():
+    import torch
+
+    if INTRA_OP_THREADS:
+        torch.set_num_threads(INTRA_OP_THREADS)
+    if INTER_OP_THREADS:
+        try:
+            torch.set_num_interop_threads(INTER_OP_THREADS)
+        except RuntimeError:
+            # Only allowed before any inter-op work has started
+            pass
+
+def create_backend(backend, task, model_name):
+    """Build the model for a backend name: 'transformers', 'onnx' or 'onnx-int8'"""
+    if backend == 'transformers':
+        from transformers import pipeline
+
+        configure_torch_threads()
+        return pipeline(task, model=model_name)
+    if backend == 'onnx':
+        return OnnxBackend(ONNX_MODEL_PATH, model_name)
+    if backend == 'onnx-int8':
+        return OnnxBackend(ONNX_INT8_MODEL_PATH, model_name)
+    raise ValueError(f"Unknown inference backend: {backend}")
+
+def export_onnx(model_name, output_path, opset=17):
+    """Export the classifier with a second output: the pooled backbone features used as embeddings"""
+    import torch
+    from transformers import AutoModelForImageClassification
+
+    model = AutoModelForImageClassification.from_pretrained(model_name).eval()
+
+    class LogitsAndEmbedding(torch.nn.Module):
+        def __init__(self, wrapped):
+            super().__init__()
+            self.wrapped = wrapped
+
+        def forward(self, pixel_values):
+            outputs = self.wrapped(pixel_values=pixel_values, output_hidden_states=True)
+            features = outputs.hidden_states[-1]
+            if features.dim() == 4:
+                features = features.mean(dim=(2, 3))
+            return outputs.logits, features
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    torch.onnx.export(
+        LogitsAndEmbedding(model),
+        torch.randn(1, 3, 224, 224),
+        output_path,
+        input_names=['pixel_values'],
+        output_names=['logits', 'embedding'],
+        dynamic_axes={'pixel_values': {0: 'batch'}, 'logits': {0: 'batch'}, 'embedding': {0: 'batch'}},
+        opset_version=opset
+    )
+    return output_path
+
+def quantize_onnx(input_path, output_path):
+    """Dynamically quantize the exported graph's weights to int8"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(input_path, output_path, weight_type=QuantType.QInt8)
+    return output_path
+
+def validate(backend, image_paths, model_name, task='image-classification', batch_size=8):
+    """
+    Compare a backend with the stock Transformers pipeline on local images
+    Reports top-1 agreement, embedding cosine similarity and the speedup
+    """
+    from attendance import _embed_batch
+
+    images = [_load_image(path) for path in image_paths]
+    reference = create_backend('transformers', task, model_name)
+    candidate = create_backend(backend, task, model_name)
+
+    def run(model):
+        labels, embeddings = [], []
+        start = time.perf_counter()
+        for i in range(0, len(images), batch_size):
+            batch = images[i:i + batch_size]
+            labels.extend(result[0]['label'] for result in model(batch, batch_size=len(batch)))
+            embeddings.append(_embed_batch(model, batch))
+        return labels, np.concatenate(embeddings), time.perf_counter() - start
+
+    # Warm up both models so one-off initialization is not timed
+    for model in (reference, candidate):
+        model(images[:1], batch_size=1)
+
+    reference_labels, reference_embeddings, reference_seconds = run(reference)
+    candidate_labels, candidate_embeddings, candidate_seconds = run(candidate)
+
+    a = reference_embeddings / np.linalg.norm(reference_embeddings, axis=1, keepdims=True)
+    b = candidate_embeddings / np.linalg.norm(candidate_embeddings, axis=1, keepdims=True)
+    similarity = (a * b).sum(axis=1)
+    return {
+        'backend': backend,
+        'images': len(images),
+        'top1_agreement': round(float(np.mean([x == y for x, y in zip(reference_labels, candidate_labels)])), 4),
+        'embedding_cosine_mean': round(float(similarity.mean()), 5),
+        'embedding_cosine_min': round(float(similarity.min()), 5),
+        'reference_ms_per_image': round(reference_seconds * 1000 / len(images), 2),
+        'backend_ms_per_image': round(candidate_seconds * 1000 / len(images), 2),
+        'speedup': round(reference_seconds / candidate_seconds, 2) if candidate_seconds else None
+    }
+
+if __name__ == '__main__':
+    from model_registry import MODEL_NAME
+
+    parser = argparse.ArgumentParser(description='Export, quantize and validate inference backends')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = commands.add_parser('export', help='export the model to ONNX')
+    export_parser.add_argument('--output', default=ONNX_MODEL_PATH)
+
+    quantize_parser = commands.add_parser('quantize', help='create a dynamically quantized int8 copy')
+    quantize_parser.add_argument('--input', default=ONNX_MODEL_PATH)
+    quantize_parser.add_argument('--output', default=ONNX_INT8_MODEL_PATH)
+
+    validate_parser = commands.add_parser('validate', help='compare a backend with the stock pipeline')
+    validate_parser.add_argument('--backend', default='onnx-int8', choices=['transformers', 'onnx', 'onnx-int8'])
+    validate_parser.add_argument('--images', default=os.path.join(_base_dir, 'uploads'), help='directory of images')
+    validate_parser.add_argument('--batch-size', type=int, default=8)
+
+    args = parser.parse_args()
+    if args.command == 'export':
+        print(f"Exported {export_onnx(MODEL_NAME, args.output)}")
+    elif args.command == 'quantize':
+        print(f"Quantized model written to {quantize_onnx(args.input, args.output)}")
+    else:
+        paths = sorted(path for path in glob.glob(os.path.join(args.images, '*'))
+                       if path.lower().endswith(('.jpg', '.jpeg', '.png')))
+        print(validate(args.backend, paths, MODEL_NAME, batch_size=args.batch_size))
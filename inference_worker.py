@@ -0,0 +1,99 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+class MicroBatcher:
+    """
+    Background worker that gathers items submitted from many request threads
+    into micro-batches and runs them through one batched function call
+
+    A batch is dispatched as soon as it holds max_batch_size items, or max_wait
+    seconds after its first item arrived, whichever comes first. batch_fn takes a
+    list of items and must return one result per item, in order.
+    """
+
+    def __init__(self, batch_fn, max_batch_size=16, max_wait=0.005, name='inference-worker'):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'batches': 0,
+            'items': 0,
+            'errors': 0,
+            'max_batch_size_seen': 0,
+            'queue_wait_seconds': 0.0,
+            'inference_seconds': 0.0
+        }
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, items):
+        """Queue items for inference; returns one Future per item"""
+        futures = []
+        now = time.perf_counter()
+        for item in items:
+            future = Future()
+            self._queue.put((item, future, now))
+            futures.append(future)
+        return futures
+
+    def run(self, items, timeout=None):
+        """Queue items and block until all of their results are available"""
+        return [future.result(timeout=timeout) for future in self.submit(items)]
+
+    def _next_batch(self):
+        # Block for the first item, then keep collecting until the batch is full or the wait expires
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            started = time.perf_counter()
+            wait = sum(started - queued_at for _, _, queued_at in batch)
+
+            try:
+                results = list(self.batch_fn([item for item, _, _ in batch]))
+                if len(results) != len(batch):
+                    # Fail every item rather than leave some futures unresolved forever
+                    raise ValueError(f"batch_fn returned {len(results)} results for {len(batch)} items")
+                for (_, future, _), result in zip(batch, results):
+                    future.set_result(result)
+                failed = False
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                failed = True
+
+            with self._stats_lock:
+                self._stats['batches'] += 1
+                self._stats['items'] += len(batch)
+                self._stats['errors'] += int(failed)
+                self._stats['max_batch_size_seen'] = max(self._stats['max_batch_size_seen'], len(batch))
+                self._stats['queue_wait_seconds'] += wait
+                self._stats['inference_seconds'] += time.perf_counter() - started
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        batches = stats['batches']
+        items = stats['items']
+        stats['queue_depth'] = self._queue.qsize()
+        stats['mean_batch_size'] = round(items / batches, 2) if batches else 0.0
+        stats['mean_queue_wait_ms'] = round(stats.pop('queue_wait_seconds') * 1000 / items, 3) if items else 0.0
+        stats['mean_inference_ms'] = round(stats.pop('inference_seconds') * 1000 / batches, 3) if batches else 0.0
+        stats['max_batch_size'] = self.max_batch_size
+        stats['max_wait_ms'] = self.max_wait * 1000
+        return stats
@@ -0,0 +1,113 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Worker threads processing attendance jobs, and how many jobs may wait for one
+JOB_WORKERS = int(os.environ.get('FAS_JOB_WORKERS', 4))
+JOB_QUEUE_SIZE = int(os.environ.get('FAS_JOB_QUEUE_SIZE', 32))
+# Finished jobs are kept this long so clients can still fetch their results
+JOB_RESULT_TTL = int(os.environ.get('FAS_JOB_RESULT_TTL', 600))
+
+class QueueFullError(Exception):
+    pass
+
+class JobQueue:
+    """
+    Bounded pool of worker threads for long-running attendance jobs
+    At most workers + queue_size jobs are accepted at once; further submissions
+    raise QueueFullError so the caller can reject them instead of piling up threads.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, queue_size=JOB_QUEUE_SIZE, result_ttl=JOB_RESULT_TTL):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='attendance-job')
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._result_ttl = result_ttl
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue fn(*args, **kwargs) and return the new job id"""
+        if not self._slots.acquire(blocking=False):
+            raise QueueFullError("Attendance job queue is full")
+
+        self._expire_finished()
+        job_id = uuid.uuid4().hex
+        job = {
+            'id': job_id,
+            'status': 'queued',
+            'submitted_at': time.time(),
+            'started_at': None,
+            'finished_at': None,
+            'result': None,
+            'error': None,
+            'done': threading.Event()
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+
+        try:
+            self._executor.submit(self._run, job, fn, args, kwargs)
+        except Exception:
+            with self._lock:
+                self._jobs.pop(job_id, None)
+            self._slots.release()
+            raise
+        return job_id
+
+    def _run(self, job, fn, args, kwargs):
+        job['status'] = 'running'
+        job['started_at'] = time.time()
+        try:
+            job['result'] = fn(*args, **kwargs)
+            job['status'] = 'done'
+        except Exception as e:
+            job['error'] = str(e)
+            job['status'] = 'failed'
+        finally:
+            job['finished_at'] = time.time()
+            self._slots.release()
+            job['done'].set()
+
+    def _expire_finished(self):
+        cutoff = time.time() - self._result_ttl
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job['finished_at'] is not None and job['finished_at'] < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+    def get(self, job_id):
+        """Return a JSON-serializable snapshot of a job, or None if it is unknown"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        return {key: value for key, value in job.items() if key != 'done'}
+
+    def wait(self, job_id, timeout=None):
+        """Block until a job finishes or the timeout passes; returns its snapshot"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        job['done'].wait(timeout)
+        return self.get(job_id)
+
+    def stats(self):
+        with self._lock:
+            statuses = [job['status'] for job in self._jobs.values()]
+        return {status: statuses.count(status) for status in ('queued', 'running', 'done', 'failed')}
+
+_queue = None
+_queue_lock = threading.Lock()
+
+def get_job_queue():
+    """Return the process-wide attendance job queue"""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = JobQueue()
+    return _queue
@@ -0,0 +1,325 @@
+"""
+Content-addressed store for the face media kept after recognition
+
+    python media_store.py compact
+    python media_store.py stats
+
+Instead of full uploads, each registration or attendance event keeps a
+normalized face crop and a small thumbnail of the whole image. Files live
+under data/media/<2 hex>/<2 hex>/<sha256>.jpg, so no directory grows large,
+and identical media is stored once. A SQLite index tracks sizes, ages and
+references, so compaction never has to scan the file tree: it drops
+attendance media past the retention period, recompresses old thumbnails,
+and evicts the oldest attendance media while the store is over its quota.
+Registration media is kept, since it is what re-enrollment works from.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import cv2
+from sqlite_connection import thread_connection
+
+_base_dir = os.path.dirname(os.path.abspath(__file__))
+MEDIA_DIR = os.environ.get('FAS_MEDIA_DIR', os.path.join(_base_dir, 'data', 'media'))
+MEDIA_MAX_MB = float(os.environ.get('FAS_MEDIA_MAX_MB', 500))
+MEDIA_RETENTION_DAYS = float(os.environ.get('FAS_MEDIA_RETENTION_DAYS', 30))
+# Thumbnails older than this are re-encoded at MEDIA_RECOMPRESS_QUALITY
+MEDIA_RECOMPRESS_DAYS = float(os.environ.get('FAS_MEDIA_RECOMPRESS_DAYS', 7))
+MEDIA_RECOMPRESS_QUALITY = int(os.environ.get('FAS_MEDIA_RECOMPRESS_QUALITY', 50))
+MEDIA_COMPACT_INTERVAL = float(os.environ.get('FAS_MEDIA_COMPACT_INTERVAL', 3600))
+
+CROP_SIZE = int(os.environ.get('FAS_MEDIA_CROP_SIZE', 160))
+CROP_QUALITY = 90
+# Margin added around the detected box so the crop keeps the whole head
+CROP_MARGIN = 0.2
+THUMB_SIZE = int(os.environ.get('FAS_MEDIA_THUMB_SIZE', 320))
+THUMB_QUALITY = 70
+
+def media_path(digest, root=MEDIA_DIR):
+    return os.path.join(root, digest[:2], digest[2:4], f"{digest}.jpg")
+
+def normalize_crop(image, box):
+    """Square crop around a (x, y, w, h) box with a margin, resized to CROP_SIZE"""
+    x, y, w, h = box
+    side = int(max(w, h) * (1 + 2 * CROP_MARGIN))
+    cx, cy = x + w // 2, y + h // 2
+    height, width = image.shape[:2]
+    left = max(0, min(cx - side // 2, width - side))
+    top = max(0, min(cy - side // 2, height - side))
+    crop = image[top:top + side, left:left + side]
+    return cv2.resize(crop, (CROP_SIZE, CROP_SIZE), interpolation=cv2.INTER_AREA)
+
+def make_thumbnail(image):
+    scale = THUMB_SIZE / max(image.shape[:2])
+    if scale >= 1:
+        return image
+    return cv2.resize(image, (max(1, int(image.shape[1] * scale)), max(1, int(image.shape[0] * scale))),
+                      interpolation=cv2.INTER_AREA)
+
+def encode_jpeg(image, quality):
+    ok, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("Could not encode image")
+    return encoded.tobytes()
+
+class MediaStore:
+    """Face crops and thumbnails on disk, indexed and reference-counted in SQLite"""
+
+    def __init__(self, root=MEDIA_DIR, max_bytes=MEDIA_MAX_MB * 1024 * 1024,
+                 retention_days=MEDIA_RETENTION_DAYS, recompress_days=MEDIA_RECOMPRESS_DAYS):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.retention_days = retention_days
+        self.recompress_days = recompress_days
+        self._local = threading.local()
+        self._compactor = None
+        self._stop = threading.Event()
+        self._last_compaction = None
+        os.makedirs(root, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS blobs (
+                    hash TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    bytes INTEGER NOT NULL,
+                    quality INTEGER NOT NULL,
+                    refs INTEGER NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS events (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    username TEXT NOT NULL,
+                    crop_hash TEXT NOT NULL,
+                    thumb_hash TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_events_kind ON events (kind, created_at)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_blobs_refs ON blobs (refs)')
+
+    def _connect(self):
+        return thread_connection(self._local, os.path.join(self.root, 'index.db'))
+
+    def path_for(self, digest):
+        return media_path(digest, self.root)
+
+    def _put_blob(self, conn, kind, data, quality, now):
+        # Called inside a write transaction, so compaction cannot remove the file meanwhile
+        digest = hashlib.sha256(data).hexdigest()
+        added = conn.execute(
+            'INSERT OR IGNORE INTO blobs (hash, kind, bytes, quality, refs, created_at) VALUES (?, ?, ?, ?, 0, ?)',
+            (digest, kind, len(data), quality, now)
+        ).rowcount == 1
+        conn.execute('UPDATE blobs SET refs = refs + 1 WHERE hash = ?', (digest,))
+        path = self.path_for(digest)
+        if added or not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        return digest
+
+    def save_event(self, kind, image, faces):
+        """
+        Keep a face crop per (username, box) in faces plus one thumbnail of the BGR image
+        kind is 'registration' or 'attendance'. Returns the stored crop path per face.
+        """
+        thumb = encode_jpeg(make_thumbnail(image), THUMB_QUALITY)
+        crops = [(username, encode_jpeg(normalize_crop(image, box), CROP_QUALITY)) for username, box in faces]
+        now = time.time()
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            paths = []
+            for username, crop in crops:
+                crop_hash = self._put_blob(conn, 'crop', crop, CROP_QUALITY, now)
+                thumb_hash = self._put_blob(conn, 'thumb', thumb, THUMB_QUALITY, now)
+                conn.execute(
+                    'INSERT INTO events (kind, username, crop_hash, thumb_hash, created_at) VALUES (?, ?, ?, ?, ?)',
+                    (kind, username, crop_hash, thumb_hash, now)
+                )
+                paths.append(self.path_for(crop_hash))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return paths
+
+    def _delete_events(self, conn, rows):
+        """Drop events and their references; returns (bytes freed, hashes of the blobs dropped)"""
+        for row in rows:
+            conn.execute('DELETE FROM events WHERE id = ?', (row['id'],))
+            conn.execute('UPDATE blobs SET refs = refs - 1 WHERE hash IN (?, ?)', (row['crop_hash'], row['thumb_hash']))
+        dropped = conn.execute('SELECT hash, bytes FROM blobs WHERE refs <= 0').fetchall()
+        conn.execute('DELETE FROM blobs WHERE refs <= 0')
+        return sum(blob['bytes'] for blob in dropped), [blob['hash'] for blob in dropped]
+
+    def _remove_files(self, conn, hashes):
+        """Remove the files of blobs dropped by a committed transaction"""
+        if not hashes:
+            return
+        # save_event may have stored the same media again since the commit; keep those files
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for digest in hashes:
+                if conn.execute('SELECT 1 FROM blobs WHERE hash = ?', (digest,)).fetchone() is not None:
+                    continue
+                try:
+                    os.remove(self.path_for(digest))
+                except FileNotFoundError:
+                    pass
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _recompress(self, conn, cutoff):
+        saved = 0
+        rows = conn.execute(
+            "SELECT hash, bytes FROM blobs WHERE kind = 'thumb' AND quality > ? AND created_at < ?",
+            (MEDIA_RECOMPRESS_QUALITY, cutoff)
+        ).fetchall()
+        for row in rows:
+            # Re-encode without holding the write lock, so uploads are not blocked meanwhile
+            path = self.path_for(row['hash'])
+            image = cv2.imread(path)
+            if image is None:
+                continue
+            data = encode_jpeg(image, MEDIA_RECOMPRESS_QUALITY)
+            temp_path = None
+            if len(data) < row['bytes']:
+                temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(temp_path, 'wb') as f:
+                    f.write(data)
+
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                # The blob may have been dropped, or recompressed by another process, meanwhile
+                current = conn.execute('SELECT quality FROM blobs WHERE hash = ?', (row['hash'],)).fetchone()
+                if current is None or current['quality'] <= MEDIA_RECOMPRESS_QUALITY:
+                    if temp_path:
+                        os.remove(temp_path)
+                    conn.execute('COMMIT')
+                    continue
+                if temp_path:
+                    # The file keeps its original address, so events still point at it
+                    os.replace(temp_path, path)
+                    saved += row['bytes'] - len(data)
+                conn.execute('UPDATE blobs SET bytes = ?, quality = ? WHERE hash = ?',
+                             (min(len(data), row['bytes']), MEDIA_RECOMPRESS_QUALITY, row['hash']))
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                if temp_path and os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+        return len(rows), saved
+
+    def compact(self, now=None):
+        """Apply retention, recompression and the size quota; returns what was done"""
+        now = now or time.time()
+        start = time.perf_counter()
+        result = {'expired': 0, 'evicted': 0, 'recompressed': 0, 'bytes_freed': 0}
+        conn = self._connect()
+
+        # Each step commits on its own, and files are only removed once their rows are gone,
+        # so a rolled-back transaction never leaves an index entry without its file
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            expired = conn.execute(
+                "SELECT id, crop_hash, thumb_hash FROM events WHERE kind = 'attendance' AND created_at < ?",
+                (now - self.retention_days * 86400,)
+            ).fetchall()
+            freed, dropped = self._delete_events(conn, expired)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        self._remove_files(conn, dropped)
+        result['expired'] = len(expired)
+        result['bytes_freed'] += freed
+
+        recompressed, saved = self._recompress(conn, now - self.recompress_days * 86400)
+        result['recompressed'] = recompressed
+        result['bytes_freed'] += saved
+
+        # Over quota: evict the oldest attendance media first, one small chunk per transaction
+        while True:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                total = conn.execute('SELECT COALESCE(SUM(bytes), 0) FROM blobs').fetchone()[0]
+                oldest = []
+                if total > self.max_bytes:
+                    oldest = conn.execute(
+                        "SELECT id, crop_hash, thumb_hash FROM events WHERE kind = 'attendance' ORDER BY created_at, id LIMIT 100"
+                    ).fetchall()
+                freed, dropped = self._delete_events(conn, oldest) if oldest else (0, [])
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            if not oldest:
+                break
+            self._remove_files(conn, dropped)
+            result['evicted'] += len(oldest)
+            result['bytes_freed'] += freed
+        result['seconds'] = round(time.perf_counter() - start, 3)
+        self._last_compaction = {'at': time.strftime('%Y-%m-%d %H:%M:%S'), **result}
+        return result
+
+    def start_compaction(self, interval=MEDIA_COMPACT_INTERVAL):
+        """Run compact() every interval seconds on a daemon thread"""
+        if self._compactor is not None:
+            return self._compactor
+
+        def _run():
+            while not self._stop.wait(interval):
+                try:
+                    self.compact()
+                except sqlite3.Error:
+                    # Another process holds the lock for long; try again next round
+                    pass
+
+        self._compactor = threading.Thread(target=_run, name='media-compaction', daemon=True)
+        self._compactor.start()
+        return self._compactor
+
+    def stats(self):
+        conn = self._connect()
+        blobs = conn.execute('SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM blobs').fetchone()
+        events = {row['kind']: row['count'] for row in
+                  conn.execute('SELECT kind, COUNT(*) AS count FROM events GROUP BY kind').fetchall()}
+        return {
+            'files': blobs[0],
+            'bytes': blobs[1],
+            'max_bytes': int(self.max_bytes),
+            'events': events,
+            'last_compaction': self._last_compaction
+        }
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_media_store():
+    """Return the process-wide media store"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = MediaStore()
+    return _store
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Maintain the face media store')
+    parser.add_argument('command', choices=['compact', 'stats'])
+    args = parser.parse_args()
+    store = get_media_store()
+    print(json.dumps(store.compact() if args.command == 'compact' else store.stats(), indent=2))
@@ -0,0 +1,203 @@
+import bisect
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# Set FAS_METRICS=0 to turn all instrumentation into no-ops
+METRICS_ENABLED = os.environ.get('FAS_METRICS', '1') == '1'
+# Opt-in sampling profiler: requests slower than this many ms get their stack samples saved
+PROFILE_SLOW_MS = float(os.environ.get('FAS_PROFILE_SLOW_MS', 0))
+PROFILE_INTERVAL_MS = float(os.environ.get('FAS_PROFILE_INTERVAL_MS', 5))
+PROFILE_DIR = os.environ.get('FAS_PROFILE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'profiles'))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense, with one series per label value"""
+
+    def __init__(self, name, help_text, buckets, label=None):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.label = label
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, value, label_value=None):
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0}
+            series['counts'][bisect.bisect_left(self.buckets, value)] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted(self._series.items(), key=lambda item: str(item[0]))
+            for label_value, series in items:
+                labels = f'{self.label}="{label_value}"' if self.label else ''
+                cumulative = 0
+                for bound, count in zip(list(self.buckets) + ['+Inf'], series['counts']):
+                    cumulative += count
+                    le = f'le="{bound}"'
+                    lines.append(f"{self.name}_bucket{{{labels + ',' if labels else ''}{le}}} {cumulative}")
+                suffix = f"{{{labels}}}" if labels else ''
+                lines.append(f"{self.name}_sum{suffix} {series['sum']}")
+                lines.append(f"{self.name}_count{suffix} {series['count']}")
+        return lines
+
+class LabelledCounter:
+    """Monotonic counter with one series per label value"""
+
+    def __init__(self, name, help_text, label):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, label_value, amount=1):
+        with self._lock:
+            self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for label_value, value in sorted(self.snapshot().items()):
+            lines.append(f'{self.name}{{{self.label}="{label_value}"}} {value}')
+        return lines
+
+request_latency = Histogram('fas_request_duration_seconds', 'HTTP request latency by endpoint',
+                            LATENCY_BUCKETS, label='endpoint')
+stage_latency = Histogram('fas_stage_duration_seconds', 'Latency of each recognition pipeline stage',
+                          LATENCY_BUCKETS, label='stage')
+faces_per_image = Histogram('fas_faces_per_image', 'Faces detected per processed image', COUNT_BUCKETS)
+batch_size = Histogram('fas_inference_batch_size', 'Images per model forward pass', COUNT_BUCKETS)
+
+faces_skipped = LabelledCounter('fas_faces_skipped_total', 'Detections dropped before inference, by reason', 'reason')
+
+HISTOGRAMS = [request_latency, stage_latency, faces_per_image, batch_size]
+
+_trace = threading.local()
+
+class _NoopStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NOOP = _NoopStage()
+
+class _Stage:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        stage_latency.observe(elapsed, self.name)
+        timings = getattr(_trace, 'timings', None)
+        if timings is not None:
+            timings[self.name] = timings.get(self.name, 0.0) + elapsed
+        return False
+
+def stage(name):
+    """Time a block as one pipeline stage: `with metrics.stage('detect'): ...`"""
+    if not METRICS_ENABLED:
+        return _NOOP
+    return _Stage(name)
+
+def observe_faces(count):
+    if METRICS_ENABLED:
+        faces_per_image.observe(count)
+
+def observe_batch(size):
+    if METRICS_ENABLED:
+        batch_size.observe(size)
+
+def observe_skipped(skipped):
+    if METRICS_ENABLED:
+        for reason, count in skipped.items():
+            faces_skipped.inc(reason, count)
+
+def start_trace():
+    """Begin collecting stage timings for the request handled by this thread"""
+    if METRICS_ENABLED:
+        _trace.timings = {}
+
+def end_trace():
+    """Stop collecting and return {stage: seconds} for this thread's request"""
+    timings = getattr(_trace, 'timings', None)
+    _trace.timings = None
+    return timings or {}
+
+def render(extra_lines=()):
+    """Prometheus text exposition of every histogram plus any extra gauge lines"""
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    lines.extend(faces_skipped.render())
+    lines.extend(extra_lines)
+    return '\n'.join(lines) + '\n'
+
+class StackSampler:
+    """
+    Sampling profiler for one thread: a helper thread records that thread's
+    stack every interval, and the samples can be saved in collapsed-stack
+    format (one 'frame;frame;frame count' line per stack) for flame graphs
+    """
+
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL_MS / 1000):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def save(self, label):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        safe_label = ''.join(c if c.isalnum() else '_' for c in label)
+        path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d_%H%M%S')}_{safe_label}.collapsed")
+        with open(path, 'w') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
+
+def start_profiler():
+    """Start sampling the current thread if slow-request profiling is enabled, else None"""
+    if PROFILE_SLOW_MS <= 0:
+        return None
+    return StackSampler(threading.get_ident()).start()
@@ -0,0 +1,120 @@
+import os
+import sys
+import threading
+import time
+
+# Model used for face recognition, shared by every part of the app
+MODEL_TASK = 'image-classification'
+MODEL_NAME = os.environ.get('FAS_MODEL_NAME', 'microsoft/resnet-50')
+# 'transformers' (default), 'onnx' or 'onnx-int8'; see inference_backends.py
+INFERENCE_BACKEND = os.environ.get('FAS_INFERENCE_BACKEND', 'transformers')
+
+_lock = threading.Lock()
+_model = None
+_warmup_thread = None
+_warmup_lock = threading.Lock()
+_stats = {
+    'model': MODEL_NAME,
+    'backend': INFERENCE_BACKEND,
+    'loaded': False,
+    'loading': False,
+    'load_seconds': None,
+    'loaded_at': None,
+    'error': None
+}
+
+def _resident_memory_mb():
+    """Return the resident memory of this process in MB, or None if unknown"""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return round(pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024), 1)
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in KB elsewhere
+    divisor = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return round(peak / divisor, 1)
+
+def get_model():
+    """
+    Return the shared recognition pipeline, loading it on first use
+    Concurrent callers wait for the single load instead of loading their own copy
+    """
+    global _model
+    if _model is not None:
+        return _model
+
+    with _lock:
+        if _model is None:
+            from inference_backends import create_backend
+
+            _stats['loading'] = True
+            _stats['error'] = None
+            memory_before = _resident_memory_mb()
+            start = time.perf_counter()
+            try:
+                _model = create_backend(INFERENCE_BACKEND, MODEL_TASK, MODEL_NAME)
+            except Exception as e:
+                _stats['error'] = str(e)
+                raise
+            finally:
+                _stats['loading'] = False
+
+            memory_after = _resident_memory_mb()
+            _stats['loaded'] = True
+            _stats['load_seconds'] = round(time.perf_counter() - start, 3)
+            _stats['loaded_at'] = time.strftime('%Y-%m-%d %H:%M:%S')
+            if memory_before is not None and memory_after is not None:
+                _stats['model_memory_mb'] = round(memory_after - memory_before, 1)
+    return _model
+
+def set_model(model):
+    """
+    Install an already constructed model instead of loading MODEL_NAME
+    Used by the benchmarks to run with a stub model. A model may provide
+    embed(images) to compute embeddings without the Transformers internals.
+    """
+    global _model
+    with _lock:
+        _model = model
+        _stats['model'] = type(model).__name__
+        _stats['loaded'] = True
+        _stats['load_seconds'] = 0.0
+        _stats['loaded_at'] = time.strftime('%Y-%m-%d %H:%M:%S')
+
+def warm_up(background=False):
+    """
+    Load the model now, optionally on a daemon thread so startup is not blocked
+    While a background load is running, further calls return the same thread.
+    """
+    global _warmup_thread
+    if not background:
+        return get_model()
+
+    def _load():
+        try:
+            get_model()
+        except Exception:
+            # The error is kept in the stats and reported by the readiness check
+            pass
+
+    # Not _lock: get_model holds that for the whole load
+    with _warmup_lock:
+        if _warmup_thread is not None and _warmup_thread.is_alive():
+            return _warmup_thread
+        _warmup_thread = threading.Thread(target=_load, name='model-warmup', daemon=True)
+        _warmup_thread.start()
+        return _warmup_thread
+
+def is_ready():
+    return _model is not None
+
+def model_stats():
+    stats = dict(_stats)
+    stats['resident_memory_mb'] = _resident_memory_mb()
+    return stats
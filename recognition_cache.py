@@ -0,0 +1,107 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+import cv2
+import numpy as np
+
+# Size and lifetime of the recognition result cache
+RECOGNITION_CACHE_SIZE = int(os.environ.get('FAS_RECOGNITION_CACHE_SIZE', 512))
+RECOGNITION_CACHE_TTL = int(os.environ.get('FAS_RECOGNITION_CACHE_TTL', 300))
+# Optionally also match near-identical re-encodes of an image by perceptual hash
+RECOGNITION_CACHE_PHASH = os.environ.get('FAS_RECOGNITION_CACHE_PHASH', '0') == '1'
+PHASH_MAX_DISTANCE = int(os.environ.get('FAS_PHASH_MAX_DISTANCE', 4))
+
+def content_hash(data):
+    """SHA-256 of the raw upload bytes"""
+    return hashlib.sha256(data).hexdigest()
+
+def perceptual_hash(image):
+    """
+    64-bit difference hash (dHash) of a BGR or grayscale image
+    Re-encoded or slightly resized copies of the same photo hash to nearby values
+    """
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int(np.packbits(bits).view('>u8')[0])
+
+class RecognitionCache:
+    """
+    Bounded LRU cache of recognition results with a time-to-live
+    Entries are keyed by content hash and tagged with the gallery version they
+    were computed against, so enrolling or removing a face invalidates them.
+    """
+
+    def __init__(self, max_entries=RECOGNITION_CACHE_SIZE, ttl=RECOGNITION_CACHE_TTL,
+                 use_phash=RECOGNITION_CACHE_PHASH, phash_max_distance=PHASH_MAX_DISTANCE):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.use_phash = use_phash
+        self.phash_max_distance = phash_max_distance
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._stats = {'hits': 0, 'phash_hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def _usable(self, entry, version, now):
+        return entry['version'] == version and now - entry['stored_at'] <= self.ttl
+
+    def get(self, key, version, phash=None):
+        """Return the cached result for an upload, or None"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if self._usable(entry, version, now):
+                    self._entries.move_to_end(key)
+                    self._stats['hits'] += 1
+                    return entry['value']
+                del self._entries[key]
+                self._stats['invalidations'] += 1
+
+            if phash is not None:
+                # Bounded by max_entries, so a linear scan stays cheap
+                for other_key, other in reversed(self._entries.items()):
+                    if (other['phash'] is not None and self._usable(other, version, now)
+                            and bin(other['phash'] ^ phash).count('1') <= self.phash_max_distance):
+                        self._entries.move_to_end(other_key)
+                        self._stats['hits'] += 1
+                        self._stats['phash_hits'] += 1
+                        return other['value']
+
+            self._stats['misses'] += 1
+            return None
+
+    def put(self, key, version, value, phash=None):
+        with self._lock:
+            self._entries[key] = {'version': version, 'stored_at': time.time(), 'value': value, 'phash': phash}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._stats['invalidations'] += len(self._entries)
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        return stats
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_recognition_cache():
+    """Return the process-wide recognition result cache"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = RecognitionCache()
+    return _cache
@@ -0,0 +1,78 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+# Number of rendered API responses kept; FAS_RESPONSE_CACHE=0 disables the cache
+RESPONSE_CACHE_SIZE = int(os.environ.get('FAS_RESPONSE_CACHE_SIZE', 256))
+RESPONSE_CACHE_ENABLED = os.environ.get('FAS_RESPONSE_CACHE', '1') == '1'
+
+def make_etag(key, version):
+    """Strong ETag for one endpoint and query at one data version"""
+    return hashlib.sha1(repr((key, version)).encode()).hexdigest()[:24]
+
+class ResponseCache:
+    """
+    Bounded LRU cache of rendered API responses
+    Entries are keyed by endpoint and query string and tagged with the data
+    version they were rendered at, so any attendance or user write makes the
+    next request render a fresh response.
+    """
+
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE, enabled=RESPONSE_CACHE_ENABLED):
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._stats = {'hits': 0, 'misses': 0, 'not_modified': 0, 'evictions': 0}
+
+    def get(self, key, version):
+        """Return the cached {body, mimetype, etag} for key at this version, or None"""
+        with self._lock:
+            entry = self._entries.get(key) if self.enabled else None
+            if entry is not None and entry['version'] == version:
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                return entry
+            self._stats['misses'] += 1
+            return None
+
+    def put(self, key, version, body, mimetype):
+        entry = {'version': version, 'body': body, 'mimetype': mimetype, 'etag': make_etag(key, version)}
+        if not self.enabled:
+            return entry
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def count_not_modified(self):
+        with self._lock:
+            self._stats['not_modified'] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        return stats
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_response_cache():
+    """Return the process-wide API response cache"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache()
+    return _cache
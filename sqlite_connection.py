@@ -0,0 +1,18 @@
+import sqlite3
+
+def thread_connection(local, path):
+    """
+    Return this thread's connection to the SQLite database at path
+    sqlite3 connections cannot be shared between threads, so each thread opens
+    its own on first use and keeps it in local, a threading.local(). The
+    database runs in WAL mode, so readers are never blocked by a writer.
+    """
+    conn = getattr(local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA busy_timeout=30000')
+        local.conn = conn
+    return conn
@@ -0,0 +1,246 @@
+import math
+import os
+import threading
+import time
+import uuid
+import cv2
+import numpy as np
+from PIL import Image
+import metrics
+from face_detector import iou
+from face_quality import filter_faces
+
+# Frame rate the stream mode must keep up with, and the most frames it may skip in a row
+STREAM_TARGET_FPS = float(os.environ.get('FAS_STREAM_TARGET_FPS', 15))
+STREAM_MAX_SKIP = int(os.environ.get('FAS_STREAM_MAX_SKIP', 5))
+# A track is dropped after this many processed frames without a matching detection
+TRACK_MAX_MISSES = int(os.environ.get('FAS_TRACK_MAX_MISSES', 5))
+# Minimum overlap (IoU) for a detection to continue an existing track
+TRACK_MIN_IOU = float(os.environ.get('FAS_TRACK_MIN_IOU', 0.3))
+# Unmatched tracks are re-tried a few times, since the first frame of a face is often blurred
+TRACK_MAX_ATTEMPTS = int(os.environ.get('FAS_TRACK_MAX_ATTEMPTS', 3))
+TRACK_RETRY_FRAMES = int(os.environ.get('FAS_TRACK_RETRY_FRAMES', 5))
+# Idle stream sessions are discarded after this many seconds
+STREAM_SESSION_TTL = int(os.environ.get('FAS_STREAM_SESSION_TTL', 1800))
+
+class StreamSession:
+    """
+    Marks attendance from a sequence of frames (a door camera or a video file)
+
+    Faces are detected on each processed frame and associated with existing
+    tracks by box overlap. Recognition runs only when a track is new (or a
+    still-unmatched track is due for a retry), and each user is marked at most
+    once per session. If frames take longer than the target frame interval to
+    process, the session starts skipping frames to keep up.
+
+    detect_fn(frame) returns (x, y, w, h) boxes, embed_fn(crops) returns an
+    embedding matrix, match_fn(embeddings) returns gallery matches per face and
+    record_fn(usernames) records attendance in one batch.
+    """
+
+    def __init__(self, detect_fn, embed_fn, match_fn, record_fn, target_fps=STREAM_TARGET_FPS):
+        self.id = uuid.uuid4().hex
+        self.detect_fn = detect_fn
+        self.embed_fn = embed_fn
+        self.match_fn = match_fn
+        self.record_fn = record_fn
+        self.frame_budget = 1.0 / target_fps
+        self.target_fps = target_fps
+        self.created_at = time.time()
+        self.last_active = self.created_at
+
+        self._lock = threading.Lock()
+        self._tracks = []
+        self._next_track_id = 1
+        self._marked = {}
+        self._frame_index = 0
+        self._skip = 0
+        self._avg_frame_seconds = None
+        self._stats = {
+            'frames_received': 0,
+            'frames_processed': 0,
+            'frames_skipped': 0,
+            'tracks_created': 0,
+            'recognitions': 0,
+            'quality_skipped': 0
+        }
+
+    def process_frame(self, frame):
+        """Process one BGR frame; returns the attendance records newly written for it"""
+        with self._lock:
+            self.last_active = time.time()
+            self._stats['frames_received'] += 1
+            index = self._frame_index
+            self._frame_index += 1
+            if index % (self._skip + 1) != 0:
+                self._stats['frames_skipped'] += 1
+                return []
+
+            started = time.perf_counter()
+            records = self._process(frame, index)
+            self._adapt(time.perf_counter() - started)
+            self._stats['frames_processed'] += 1
+            return records
+
+    def _adapt(self, seconds):
+        # Exponential moving average of the processing time of one frame
+        if self._avg_frame_seconds is None:
+            self._avg_frame_seconds = seconds
+        else:
+            self._avg_frame_seconds = 0.8 * self._avg_frame_seconds + 0.2 * seconds
+        # Process one frame in every (skip + 1) so the average cost fits the frame budget
+        needed = math.ceil(self._avg_frame_seconds / self.frame_budget) - 1
+        self._skip = max(0, min(STREAM_MAX_SKIP, needed))
+
+    def _process(self, frame, index):
+        boxes = [tuple(int(v) for v in box) for box in self.detect_fn(frame)]
+
+        # Greedy IoU association: best-overlapping pairs first
+        pairs = []
+        for t, track in enumerate(self._tracks):
+            for d, box in enumerate(boxes):
+                overlap = iou(track['box'], box)
+                if overlap >= TRACK_MIN_IOU:
+                    pairs.append((overlap, t, d))
+        pairs.sort(reverse=True)
+
+        matched_tracks = set()
+        matched_boxes = set()
+        for _, t, d in pairs:
+            if t in matched_tracks or d in matched_boxes:
+                continue
+            matched_tracks.add(t)
+            matched_boxes.add(d)
+            self._tracks[t]['box'] = boxes[d]
+            self._tracks[t]['misses'] = 0
+            self._tracks[t]['last_frame'] = index
+
+        for t, track in enumerate(self._tracks):
+            if t not in matched_tracks:
+                track['misses'] += 1
+        self._tracks = [track for track in self._tracks if track['misses'] <= TRACK_MAX_MISSES]
+
+        for d, box in enumerate(boxes):
+            if d not in matched_boxes:
+                self._tracks.append({
+                    'id': self._next_track_id,
+                    'box': box,
+                    'misses': 0,
+                    'last_frame': index,
+                    'username': None,
+                    'attempts': 0,
+                    'last_attempt': None
+                })
+                self._next_track_id += 1
+                self._stats['tracks_created'] += 1
+
+        # Recognize new tracks, and unmatched ones that are due for another try
+        pending = [track for track in self._tracks
+                   if track['misses'] == 0 and track['username'] is None
+                   and track['attempts'] < TRACK_MAX_ATTEMPTS
+                   and (track['last_attempt'] is None or index - track['last_attempt'] >= TRACK_RETRY_FRAMES)]
+        if not pending:
+            return []
+
+        # A track whose face is blurred or too small in this frame waits for a
+        # later frame instead of spending one of its recognition attempts
+        usable, skipped = filter_faces(frame, [track['box'] for track in pending])
+        metrics.observe_skipped(skipped)
+        for track in pending:
+            if track['box'] not in usable:
+                track['last_attempt'] = index
+                self._stats['quality_skipped'] += 1
+        pending = [track for track in pending if track['box'] in usable]
+        if not pending:
+            return []
+
+        crops = []
+        for track in pending:
+            x, y, w, h = track['box']
+            crops.append(Image.fromarray(cv2.cvtColor(frame[y:y+h, x:x+w], cv2.COLOR_BGR2RGB)))
+            track['attempts'] += 1
+            track['last_attempt'] = index
+        self._stats['recognitions'] += len(crops)
+        matches = self.match_fn(self.embed_fn(crops))
+
+        new_usernames = []
+        for track, face_matches in zip(pending, matches):
+            if not face_matches:
+                continue
+            username = face_matches[0]['username']
+            track['username'] = username
+            if username not in self._marked and username not in new_usernames:
+                new_usernames.append(username)
+
+        records = self.record_fn(new_usernames) if new_usernames else []
+        for record in records:
+            self._marked[record['username']] = record['timestamp']
+        return records
+
+    def process_video(self, video_path):
+        """Process every frame of a video file; returns all attendance records written"""
+        capture = cv2.VideoCapture(video_path)
+        if not capture.isOpened():
+            raise ValueError("Could not open video")
+
+        # Skip decisions are based on the video's own frame rate when it is known
+        fps = capture.get(cv2.CAP_PROP_FPS)
+        if fps and fps > 0:
+            self.frame_budget = 1.0 / fps
+
+        records = []
+        try:
+            while True:
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                records.extend(self.process_frame(frame))
+        finally:
+            capture.release()
+        return records
+
+    def summary(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                'id': self.id,
+                'target_fps': self.target_fps,
+                'current_skip': self._skip,
+                'avg_frame_ms': round(self._avg_frame_seconds * 1000, 2) if self._avg_frame_seconds else None,
+                'active_tracks': len(self._tracks),
+                'marked': [{'username': username, 'timestamp': timestamp}
+                           for username, timestamp in self._marked.items()]
+            })
+        return stats
+
+class StreamSessionRegistry:
+    """Keeps open stream sessions by id and drops ones that have gone idle"""
+
+    def __init__(self, ttl=STREAM_SESSION_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._sessions = {}
+
+    def add(self, session):
+        with self._lock:
+            self._expire()
+            self._sessions[session.id] = session
+        return session
+
+    def get(self, session_id):
+        with self._lock:
+            self._expire()
+            return self._sessions.get(session_id)
+
+    def remove(self, session_id):
+        with self._lock:
+            return self._sessions.pop(session_id, None)
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        for session_id in [sid for sid, session in self._sessions.items() if session.last_active < cutoff]:
+            del self._sessions[session_id]
+
+def decode_frame(data):
+    """Decode one JPEG/PNG frame from raw bytes into a BGR array, or None if it is not an image"""
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
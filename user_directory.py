@@ -0,0 +1,126 @@
+import json
+import os
+import threading
+from file_lock import file_lock
+
+_base_dir = os.path.dirname(os.path.abspath(__file__))
+USERS_DB_PATH = os.path.join(_base_dir, 'data', 'users.json')
+
+class UserDirectory:
+    """
+    In-process cache of data/users.json with a username index
+    The file is only re-read when its mtime or size changes, so lookups are O(1)
+    while the data is unchanged. Writes go through add_user, which updates the
+    file and the cache together.
+    """
+
+    def __init__(self, path=USERS_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._users = []
+        self._by_username = {}
+        self._signature = None
+        self.hits = 0
+        self.misses = 0
+        self.version = 0
+
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _index(self, users):
+        by_username = {}
+        for user in users:
+            # When a username was registered more than once, the latest entry wins
+            by_username[user['username']] = user
+        self._users = users
+        self._by_username = by_username
+        self.version += 1
+
+    def _refresh(self):
+        signature = self._file_signature()
+        if signature is not None and signature == self._signature:
+            self.hits += 1
+            return
+        self.misses += 1
+        users = []
+        if signature is not None:
+            with open(self.path, 'r') as f:
+                users = json.load(f)
+        self._index(users)
+        self._signature = signature
+
+    def all_users(self):
+        """Return the list of registered users; callers must not modify it"""
+        with self._lock:
+            self._refresh()
+            return self._users
+
+    def latest_users(self):
+        """Return the latest entry of each username, keyed by username; callers must not modify it"""
+        with self._lock:
+            self._refresh()
+            return self._by_username
+
+    def get(self, username):
+        with self._lock:
+            self._refresh()
+            return self._by_username.get(username)
+
+    def first_user(self):
+        with self._lock:
+            self._refresh()
+            return self._users[0] if self._users else None
+
+    def add_user(self, user):
+        """Append a user and write the file through, keeping the cache current"""
+        self.add_users([user])
+
+    def add_users(self, new_users):
+        """Append several users with a single write of the file"""
+        # The file lock keeps a concurrent writer in another process (the server and
+        # bulk_enroll.py, say) from replacing the file with a list missing our users
+        with self._lock, file_lock(f"{self.path}.lock"):
+            self._refresh()
+            users = self._users + list(new_users)
+            # Write to a temporary file first so readers never see a half-written list
+            temp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(temp_path, 'w') as f:
+                json.dump(users, f, indent=4)
+            os.replace(temp_path, self.path)
+            self._index(users)
+            self._signature = self._file_signature()
+
+    def data_version(self):
+        """
+        Return the users file's (mtime_ns, size), re-reading it if it changed
+        Unlike self.version this is the same in every process.
+        """
+        with self._lock:
+            self._refresh()
+            return self._signature
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            'users': len(self._users),
+            'version': self.version
+        }
+
+_directory = None
+_directory_lock = threading.Lock()
+
+def get_user_directory():
+    """Return the process-wide user directory"""
+    global _directory
+    if _directory is None:
+        with _directory_lock:
+            if _directory is None:
+                _directory = UserDirectory()
+    return _directory